@@ -1,10 +1,112 @@
-import os, tempfile, torch, torchaudio, whisper, torch.nn.functional as F
-from torchaudio.pipelines import WAVLM_LARGE
+import os, json, hashlib, functools, tempfile, torch, torchaudio, whisper, torch.nn.functional as F
+from typing import NamedTuple
+from torchaudio.pipelines import WAVLM_BASE_PLUS, WAVLM_LARGE
 import matplotlib.pyplot as plt
 import util
+import align_text
+import model_registry
+import tts_cache
 
 device: str = "cpu"
-whisper_model = whisper.load_model("base.en", device=device)
+EMBED_BATCH_SIZE = int(os.getenv("WAVLM_BATCH_SIZE", "16"))  # word clips per WavLM forward
+PREPROCESS_BATCH_SIZE = int(os.getenv("PREPROCESS_BATCH_SIZE", "16"))  # clips filtered/normalized together
+MIN_CLIP_SAMPLES = 160  # clips shorter than 10 ms at 16 kHz are skipped
+SCORING_ENGINES = ("word", "frame")
+FRAME_STRIDE = 320      # WavLM conv front-end hop: 20 ms at 16 kHz
+FRAME_WINDOW_S = 30.0   # max audio per WavLM forward in the frame engine
+FRAME_OVERLAP_S = 2.0   # context shared by neighbouring windows
+
+WHISPER_MODEL = model_registry.register(
+    "whisper:base.en", lambda: whisper.load_model("base.en", device=device), thread_safe=False
+)
+
+# WavLM embedding backend: "<variant>[-<flavor>]", variant "large" (the reference)
+# or "base-plus" (smaller); flavor none (fp32), "int8" (dynamic int8 quantization),
+# "onnx" or "onnx-int8" (ONNX Runtime, see `wavlm_onnx`)
+WAVLM_BACKEND = os.getenv("WAVLM_BACKEND", "large").lower()
+WAVLM_BUNDLES = {"large": WAVLM_LARGE, "base-plus": WAVLM_BASE_PLUS}
+WAVLM_FLAVORS = ("fp32", "int8", "onnx", "onnx-int8")
+WAVLM_GROUP_NORM = {"base-plus"}  # variants whose feature extractor uses group norm (see `pads_exactly`)
+
+def parse_wavlm_backend(backend: str) -> tuple[str, str]:
+    """Split a WAVLM_BACKEND value into (variant, flavor)."""
+    for variant in WAVLM_BUNDLES:
+        if backend == variant:
+            return variant, "fp32"
+        flavor = backend[len(variant) + 1:]
+        if backend.startswith(variant + "-") and flavor in WAVLM_FLAVORS:
+            return variant, flavor
+    raise ValueError(f"Unsupported WavLM backend: {backend}")
+
+# Which transformer layer the scorer uses: "last", a layer number (1 = first layer;
+# WavLM stops there, the layers above are never run) or "mix" (softmax-weighted sum
+# of the first len(weights) layers, weights learned offline, JSON list in
+# WAVLM_LAYER_WEIGHTS)
+WAVLM_LAYER = os.getenv("WAVLM_LAYER", "last").lower()
+WAVLM_LAYER_WEIGHTS = os.getenv("WAVLM_LAYER_WEIGHTS", "")
+
+class LayerSpec(NamedTuple):
+    num_layers: int | None          # layers to run, None for all
+    weights: torch.Tensor | None    # mix weights over those layers, None for the top one
+    tag: str                        # part of `embed_tag`
+
+def layer_spec(layer: str = WAVLM_LAYER, weights_path: str = WAVLM_LAYER_WEIGHTS) -> LayerSpec:
+    """Parse the WAVLM_LAYER / WAVLM_LAYER_WEIGHTS settings."""
+    if layer == "last":
+        return LayerSpec(None, None, "last")
+    if layer == "mix":
+        if not weights_path:
+            raise ValueError("WAVLM_LAYER=mix needs WAVLM_LAYER_WEIGHTS (JSON list of per-layer weights)")
+        with open(weights_path, "r") as f:
+            weights = [float(w) for w in json.load(f)]
+        digest = hashlib.sha256(json.dumps(weights).encode()).hexdigest()[:12]
+        return LayerSpec(len(weights), torch.tensor(weights), f"mix{len(weights)}-{digest}")
+    if layer.isdigit() and int(layer) > 0:
+        return LayerSpec(int(layer), None, f"layer{layer}")
+    raise ValueError(f"Unsupported WAVLM_LAYER: {layer}")
+
+LAYER_SPEC = layer_spec()
+
+class WavLMConfigError(ValueError):
+    """WavLM settings that do not fit the selected model; never scored around."""
+
+def check_layer_spec(model, variant: str, spec: LayerSpec = LAYER_SPEC) -> None:
+    """Raise WavLMConfigError if `spec` needs more transformer layers than `model` has."""
+    depth = len(model.encoder.transformer.layers)
+    if spec.num_layers and spec.num_layers > depth:
+        raise WavLMConfigError(
+            f"WAVLM_LAYER={WAVLM_LAYER} ({spec.tag}) needs {spec.num_layers} transformer layers, "
+            f"but WavLM {variant} has {depth}"
+        )
+
+def _load_wavlm(variant: str, flavor: str):
+    def load():
+        model = WAVLM_BUNDLES[variant].get_model().eval()
+        check_layer_spec(model, variant)
+        return model
+    if flavor == "int8":
+        return torch.ao.quantization.quantize_dynamic(load(), {torch.nn.Linear}, dtype=torch.qint8)
+    if flavor.startswith("onnx"):
+        from wavlm_onnx import OnnxWavLM
+        # the exported graph stops at the configured layer as well
+        return OnnxWavLM.from_model(load, variant, int8=flavor == "onnx-int8",
+                                    num_layers=LAYER_SPEC.num_layers,
+                                    group_norm=variant in WAVLM_GROUP_NORM)
+    return load().to(device)
+
+def wavlm_model(backend: str = WAVLM_BACKEND) -> str:
+    """Register (once) and return the model-registry name of a WavLM backend."""
+    variant, flavor = parse_wavlm_backend(backend)
+    name = f"wavlm:{variant}" + ("" if flavor == "fp32" else f":{flavor}")
+    if flavor.startswith("onnx") and LAYER_SPEC.num_layers:
+        name += f":L{LAYER_SPEC.num_layers}"
+    return model_registry.register(name, lambda: _load_wavlm(variant, flavor))
+
+def embed_tag(model_name: str) -> str:
+    """Identifies cached native embeddings of a WavLM model/config."""
+    return f"{model_name}:{LAYER_SPEC.tag}:mean"
+
+WAVLM_MODEL = wavlm_model()
 
 
 # --- Audio Preprocessing ---
@@ -18,17 +120,230 @@ def highpass_filter(wav, sr, cutoff=80):
     # Remove low-frequency rumble/noise
     return torchaudio.functional.highpass_biquad(wav, sr, cutoff)
 
-def preprocess_wav(path, sr, cutoff=80, target_rms=0.1):
+@functools.lru_cache(maxsize=None)
+def resampler(src_sr: int, dst_sr: int):
+    """Resample transform for src_sr -> dst_sr; its sinc kernel is built only once."""
+    return torchaudio.transforms.Resample(src_sr, dst_sr)
+
+def load_audio(path, sr):
+    """
+    Decode `path` to a raw mono (1, T) tensor at `sr`, without filtering.
+    Audio that is already mono at `sr` (uploads and cached TTS renderings are
+    converted to 16 kHz mono) is returned as decoded.
+    """
     wav, s = torchaudio.load(path)
-    wav = torchaudio.transforms.Resample(s, sr)(wav).mean(0, keepdim=True)
+    if wav.shape[0] > 1:
+        wav = wav.mean(0, keepdim=True)  # downmix first, so only one channel is resampled
+    if s != sr:
+        wav = resampler(s, sr)(wav)
+    return wav
+
+def preprocess_clip(wav, sr, cutoff=80, target_rms=0.1):
+    """Highpass and RMS‑normalize an already decoded (1, T) clip at `sr`."""
     wav = highpass_filter(wav, sr, cutoff)
-    wav = normalize_rms(wav, target_rms)
+    return normalize_rms(wav, target_rms)
+
+def preprocess_clips(clips, sr, cutoff=80, target_rms=0.1):
+    """
+    `preprocess_clip` for many (1, T) clips at once -> list of (1, T) clips.
+
+    The clips are zero‑padded into one (N, T_max) batch and filtered in a
+    single call. The highpass is a causal IIR filter, so padding after a clip
+    never leaks into it, and each clip's RMS is taken over its own samples
+    only: results match `preprocess_clip` per clip.
+    """
+    if not clips:
+        return []
+    lengths = torch.tensor([c.shape[-1] for c in clips])
+    batch = torch.zeros(len(clips), max(1, int(lengths.max())))
+    for row, clip in enumerate(clips):
+        batch[row, :lengths[row]] = clip.reshape(-1)
+    batch = highpass_filter(batch, sr, cutoff)
+    mask = torch.arange(batch.shape[1])[None, :] < lengths[:, None]
+    rms = (batch.pow(2) * mask).sum(1).div(lengths.clamp(min=1)).sqrt()
+    scale = torch.where(rms > 0, target_rms / rms, torch.ones_like(rms))
+    batch = batch * scale[:, None]
+    return [batch[row:row + 1, :lengths[row]] for row in range(len(clips))]
+
+def preprocess_wav(path, sr, cutoff=80, target_rms=0.1):
+    wav = preprocess_clip(load_audio(path, sr), sr, cutoff, target_rms)
 
     # Save the processed waveform to a temporary WAV file for inspection/debugging
     # temp_wav_path = path.replace(".wav", "_processed.wav")
     # torchaudio.save(temp_wav_path, wav, sr)
     return wav
 
+# --- WavLM embeddings ---
+@torch.no_grad()
+def layer_features(wavlm, wav, lengths=None, spec: LayerSpec = LAYER_SPEC):
+    """
+    Features of the configured layer (or layer mix) for a (B, T) batch ->
+    ((B, frames, D), frame lengths). WavLM only runs up to `spec.num_layers`.
+    """
+    feats, frame_lengths = wavlm.extract_features(
+        wav.to(device), lengths=None if lengths is None else lengths.to(device),
+        num_layers=spec.num_layers,
+    )
+    if spec.weights is None:
+        return feats[-1], frame_lengths
+    weights = torch.softmax(spec.weights, 0).to(device=feats[0].device, dtype=feats[0].dtype)
+    return torch.stack(feats).mul(weights[:, None, None, None]).sum(0), frame_lengths
+
+@torch.no_grad()
+def embed(wavlm, wav):
+    """Mean‑pooled embedding (configured layer, see WAVLM_LAYER) of a single (1, T) clip -> (1, D)."""
+    feats, _ = layer_features(wavlm, wav)
+    return feats.mean(1)
+
+def pads_exactly(wavlm) -> bool:
+    """
+    Whether zero padding leaves a clip's valid frames unchanged. Not with a
+    group-norm feature extractor (WavLM Base+): its first conv layer normalizes
+    every channel over the whole, padded, time axis.
+    """
+    group_norm = getattr(wavlm, "group_norm", None)   # OnnxWavLM says so itself
+    if group_norm is None:
+        group_norm = isinstance(wavlm.feature_extractor.conv_layers[0].layer_norm, torch.nn.GroupNorm)
+    return not group_norm
+
+@torch.no_grad()
+def embed_clips(wavlm, clips, batch_size: int = EMBED_BATCH_SIZE):
+    """
+    Mean‑pooled embeddings (configured layer) for many (1, T) clips -> (N, D).
+
+    Clips are sorted by length, zero‑padded into batches of at most
+    `batch_size` and run through WavLM with their true lengths, so each batch
+    is one forward pass. Pooling only covers the valid (unpadded) frames,
+    which keeps results within float tolerance of calling `embed` per clip.
+    That only holds for layer-norm models (WavLM Large); for group-norm ones
+    (see `pads_exactly`) only clips of equal length share a batch, which in
+    practice means about one forward per clip.
+    """
+    if not clips:
+        return torch.empty(0)
+    order = sorted(range(len(clips)), key=lambda i: clips[i].shape[-1])
+    exact = pads_exactly(wavlm)
+    batches: list[list[int]] = []
+    for i in order:
+        last = batches[-1] if batches else None
+        if last and len(last) < max(1, batch_size) and (exact or clips[last[0]].shape[-1] == clips[i].shape[-1]):
+            last.append(i)
+        else:
+            batches.append([i])
+    pooled: list = [None] * len(clips)
+    for idx in batches:
+        lengths = torch.tensor([clips[i].shape[-1] for i in idx])
+        batch = torch.zeros(len(idx), int(lengths.max()))
+        for row, i in enumerate(idx):
+            batch[row, :lengths[row]] = clips[i].reshape(-1)
+        feats, frame_lengths = layer_features(wavlm, batch, lengths)   # (B, frames, D)
+        mask = torch.arange(feats.shape[1], device=feats.device)[None, :] < frame_lengths[:, None]
+        mask = mask.unsqueeze(-1).to(feats.dtype)
+        means = (feats * mask).sum(1) / mask.sum(1).clamp(min=1)
+        for row, i in enumerate(idx):
+            pooled[i] = means[row]
+    return torch.stack(pooled)
+
+@torch.no_grad()
+def encode_frames(wavlm, wav, sr: int = 16000,
+                  window_s: float = FRAME_WINDOW_S, overlap_s: float = FRAME_OVERLAP_S):
+    """
+    Frame features (configured layer) of a (1, T) clip -> (frames, D), one
+    frame per `FRAME_STRIDE` samples.
+
+    Audio longer than `window_s` is encoded in windows that overlap by
+    `overlap_s`; each window contributes only its central frames, so every
+    frame keeps context on both sides and memory stays bounded. Windows start
+    on frame boundaries, so window frame j is frame start / FRAME_STRIDE + j of
+    the clip and the result matches a single pass frame for frame.
+    """
+    wav = wav.reshape(1, -1)
+    total = wav.shape[1]
+    window = max(FRAME_STRIDE, int(window_s * sr) // FRAME_STRIDE * FRAME_STRIDE)
+    if total <= window:
+        feats, _ = layer_features(wavlm, wav)
+        return feats[0]
+    # frames trimmed per side; at least one, since a window's last frame is cut short
+    margin = max(1, int(overlap_s * sr / 2) // FRAME_STRIDE)
+    hop = window - 2 * margin * FRAME_STRIDE
+    if hop <= 0:
+        raise ValueError("overlap_s must be shorter than window_s")
+    chunks = []
+    for start in range(0, total, hop):
+        feats, lengths = layer_features(wavlm, wav[:, start:start + window])
+        n = int(lengths[0]) if lengths is not None else feats.shape[1]
+        # this window owns frames [start + lo, start + hop + margin) of the clip
+        lo = 0 if start == 0 else margin
+        last = start + window >= total
+        hi = n if last else hop // FRAME_STRIDE + margin
+        if hi > n:
+            raise RuntimeError(f"WavLM returned {n} frames for a {window}-sample window, expected at least {hi}")
+        chunks.append(feats[0, lo:hi])
+        if last:
+            break
+    return torch.cat(chunks)
+
+def pool_frames(frames, start: float, end: float, sr: int = 16000):
+    """Mean of the frames whose hop falls inside [start, end] seconds -> (D,)."""
+    f0 = min(int(start * sr) // FRAME_STRIDE, frames.shape[0] - 1)
+    f1 = max(f0 + 1, min(-(-int(end * sr) // FRAME_STRIDE), frames.shape[0]))
+    return frames[f0:f1].mean(0)
+
+def word_embeddings(wavlm, user_wav, words, sr: int = 16000, engine: str = "word",
+                    batched: bool = True, batch_size: int = EMBED_BATCH_SIZE):
+    """
+    Embed every word of `user_wav` (times in seconds relative to the clip).
+
+    • engine="word"  ->  each word slice re‑encoded by WavLM on its own
+                         (batched or one forward per word)
+    • engine="frame" ->  the clip is encoded once and frame features are
+                         pooled inside each word span, with surrounding context
+
+    Words shorter than `MIN_CLIP_SAMPLES` are dropped.
+    Returns (kept_words, embeddings) with embeddings of shape (N, D).
+    """
+    if engine == "frame":
+        kept = [w for w in words if int(w["end"] * sr) - int(w["start"] * sr) >= MIN_CLIP_SAMPLES]
+        if not kept:
+            return kept, torch.empty(0)
+        frames = encode_frames(wavlm, user_wav, sr)
+        return kept, torch.stack([pool_frames(frames, w["start"], w["end"], sr) for w in kept])
+    if engine != "word":
+        raise ValueError(f"Unknown scoring engine '{engine}'")
+    kept, clips = [], []
+    for w in words:
+        clip = user_wav[:, int(w["start"] * sr): int(w["end"] * sr)]
+        if clip.shape[1] < MIN_CLIP_SAMPLES:   # too short → skip
+            continue
+        kept.append(w)
+        clips.append(clip)
+    if batched:
+        return kept, embed_clips(wavlm, clips, batch_size)
+    embs = [embed(wavlm, clip)[0] for clip in clips]
+    return kept, torch.stack(embs) if embs else torch.empty(0)
+
+def plot_word_scores(word_scores):
+    labs, vals = zip(*[(w["word"], w["score"]) for w in word_scores])
+    colors = ["#4CAF50" if v >= .5 else "#FFC107" if v >= .3 else "#F44336" for v in vals]  # better color palette
+    fig, ax = plt.subplots(figsize=(max(8, len(labs)), 4))
+    bars = ax.bar(labs, vals, color=colors, edgecolor="black", linewidth=0.7)
+    ax.axhline(.3, ls="--", c="gray", label="Needs improvement")
+    ax.axhline(.5, ls="--", c="blue", label="Good pronunciation")
+    ax.set_ylim(0, 1)
+    ax.set_xticks(range(len(labs)))
+    ax.set_xticklabels(labs, rotation=45, ha="right", fontsize=10)
+    ax.set_ylabel("Cosine similarity", fontsize=12)
+    ax.set_title("Word-by-word Pronunciation Score", fontsize=14)
+    ax.legend()
+    fig.tight_layout()
+
+    # Annotate bars with score values
+    for bar, val in zip(bars, vals):
+        ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height() + 0.02,
+                f"{val:.2f}", ha="center", va="bottom", fontsize=9)
+
+    plt.show()
+
 # --------------- main scorer -----------------
 def score_sentence(
     user_audio_path: str,
@@ -37,87 +352,138 @@ def score_sentence(
     sr: int = 16000,
     tts_engine: str = "gtts",
     visualize: bool = True,
+    batched: bool = True,
+    batch_size: int = EMBED_BATCH_SIZE,
+    engine: str = "word",
 ):
     """
+    Transcribe `user_audio_path` with Whisper for word timestamps, then score
+    it with `score_sentence_words`.
     If `native_audio_path` is None, a native reference is auto‑generated from
     the user's transcribed text via TTS (chosen by `tts_engine`).
     Returns (word_scores, sentence_score).
     If any error occurs, returns a below average score and logs the error.
     """
     try:
-        # Whisper forced alignment
-        result = whisper_model.transcribe(
-            user_audio_path, word_timestamps=True, language="en",
-            condition_on_previous_text=False,
-        )
-        words = [
-            {"word": w["word"].strip(), "start": w["start"], "end": w["end"]}
-            for seg in result["segments"] for w in seg["words"]
-        ]
+        if align_text.ASR_BACKEND == "faster_whisper":
+            # same quantized engine as the transcript (see align_text.ASR_BACKEND)
+            asr_name = align_text.timeline_model("base.en", device, backend="faster_whisper")
+            with model_registry.use(asr_name) as asr:
+                words = [
+                    {"word": w["text"], "start": w["start"], "end": w["end"]}
+                    for w in align_text.transcribe_audio(asr, user_audio_path, "faster_whisper")
+                ]
+        else:
+            # Whisper forced alignment
+            with model_registry.use(WHISPER_MODEL) as whisper_model:
+                result = whisper_model.transcribe(
+                    user_audio_path, word_timestamps=True, language="en",
+                    condition_on_previous_text=False,
+                )
+            words = [
+                {"word": w["word"].strip(), "start": w["start"], "end": w["end"]}
+                for seg in result["segments"] for w in seg["words"]
+            ]
+    except Exception as e:
+        import logging
+        logging.error(f"Accent scoring failed: {e}")
+        return [], 0.25
+    return score_sentence_words(
+        user_audio_path, words,
+        native_audio_path=native_audio_path, native_txt=native_txt, sr=sr,
+        tts_engine=tts_engine, visualize=visualize,
+        batched=batched, batch_size=batch_size, engine=engine,
+    )
 
+def score_sentence_words(
+    user_audio: str | torch.Tensor,
+    words: list[dict],
+    native_audio_path: str | None = None,
+    native_txt: str = "",
+    native_out_path: str | None = None,
+    sr: int = 16000,
+    tts_engine: str = "gtts",
+    visualize: bool = True,
+    batched: bool = True,
+    batch_size: int = EMBED_BATCH_SIZE,
+    engine: str = "word",
+    wavlm_backend: str = WAVLM_BACKEND,
+    preprocessed: bool = False,
+    strict: bool = False,
+):
+    """
+    Score a sentence whose word timings are already known, e.g. from the
+    conversation‑level alignment in `align_text.make_timeline`, so no second
+    ASR pass is needed. `words` are dicts with 'word', 'start', 'end' in
+    seconds relative to the start of `user_audio`.
+    `user_audio` is either a WAV path or an already decoded raw mono (1, T)
+    tensor at `sr`, e.g. a slice of the whole conversation; pass
+    `preprocessed` when that tensor already went through `preprocess_clips`.
+    If `native_audio_path` is None, a native reference is auto‑generated from
+    `native_txt` via TTS (chosen by `tts_engine`) and written to
+    `native_out_path` (default: next to a `user_audio` path). With TTS_CACHE
+    on, the rendering and its embedding come from `tts_cache`.
+    `engine` selects how words are embedded (see `word_embeddings`); with the
+    "word" engine and `batched`, word clips go through WavLM in padded
+    batches of `batch_size` instead of one forward pass per word.
+    `wavlm_backend` selects the embedding model (see WAVLM_BACKEND).
+    Returns (word_scores, sentence_score).
+    If any error occurs, returns a below average score and logs the error
+    (or re-raises it with `strict`). A WavLMConfigError is always re-raised,
+    since every sentence would fail the same way.
+    """
+    try:
         # Produce native reference if needed
-        if native_audio_path is None:
-            native_audio_path = user_audio_path.replace(".wav", "_native.wav")
-            util.synthesize_native(native_txt, native_audio_path, engine=tts_engine)
+        if native_audio_path is None and native_out_path is None:
+            if not isinstance(user_audio, str):
+                raise ValueError("native_out_path is required when user_audio is a tensor")
+            native_out_path = user_audio.replace(".wav", "_native.wav")
 
-        # Load, filter, and normalize both clips
-        user_wav = preprocess_wav(user_audio_path, sr)
-        native_wav = preprocess_wav(native_audio_path, sr)
+        # Load, filter, and normalize the user clip
+        if isinstance(user_audio, str):
+            user_wav = preprocess_wav(user_audio, sr)
+        elif preprocessed:
+            user_wav = user_audio
+        else:
+            user_wav = preprocess_clip(user_audio, sr)
 
         # WavLM embeddings
-        wavlm = WAVLM_LARGE.get_model().to(device).eval()
-        @torch.no_grad()
-        def emb(w):  # mean‑pooled last‑layer embedding
-            feats, _ = wavlm.extract_features(w.to(device))
-            return feats[-1].mean(1)
-
-        native_emb = emb(native_wav)
-
-        # helper to slice word audio
-        def slice_word(wav, start, end):
-            return wav[:, int(start * sr): int(end * sr)]
+        model_name = wavlm_model(wavlm_backend)
+        # use(): counted in use, so the idle evictor cannot drop it mid-forward
+        with model_registry.use(model_name) as wavlm:
+            if native_audio_path is not None:
+                native_emb = embed(wavlm, preprocess_wav(native_audio_path, sr))
+            elif tts_cache.ENABLED:
+                # rendered audio and its embedding are shared across sentences
+                tts_cache.copy_native_wav(native_txt, tts_engine, native_out_path, sr)
+                native_emb = tts_cache.native_embedding(
+                    native_txt, tts_engine, embed_tag(model_name),
+                    lambda path: embed(wavlm, preprocess_wav(str(path), sr)), sr,
+                )
+            else:
+                util.synthesize_native(native_txt, native_out_path, engine=tts_engine)
+                native_emb = embed(wavlm, preprocess_wav(native_out_path, sr))
 
-        # Score words
+            # Score words
+            kept, word_embs = word_embeddings(
+                wavlm, user_wav, words, sr, engine=engine, batched=batched, batch_size=batch_size,
+            )
         word_scores = []
-        for w in words:
-            clip = slice_word(user_wav, w["start"], w["end"])
-            if clip.shape[1] < 160:            # too short → skip
-                continue
-            s = torch.nn.functional.cosine_similarity(emb(clip), native_emb).item()
+        for w, e in zip(kept, word_embs):
+            s = torch.nn.functional.cosine_similarity(e[None, :], native_emb).item()
             word_scores.append({"word": w["word"], "score": s})
         sentence_score = float(torch.tensor([ws["score"] for ws in word_scores]).mean())
 
         # Improved visualization
         if visualize and word_scores:
-            labs, vals = zip(*[(w["word"], w["score"]) for w in word_scores])
-            colors = ["#4CAF50" if v >= .5 else "#FFC107" if v >= .3 else "#F44336" for v in vals]  # better color palette
-            fig, ax = plt.subplots(figsize=(max(8, len(labs)), 4))
-            bars = ax.bar(labs, vals, color=colors, edgecolor="black", linewidth=0.7)
-            ax.axhline(.3, ls="--", c="gray", label="Needs improvement")
-            ax.axhline(.5, ls="--", c="blue", label="Good pronunciation")
-            ax.set_ylim(0, 1)
-            ax.set_xticks(range(len(labs)))
-            ax.set_xticklabels(labs, rotation=45, ha="right", fontsize=10)
-            ax.set_ylabel("Cosine similarity", fontsize=12)
-            ax.set_title("Word-by-word Pronunciation Score", fontsize=14)
-            ax.legend()
-            fig.tight_layout()
-
-            # Annotate bars with score values
-            for bar, val in zip(bars, vals):
-                ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height() + 0.02,
-                        f"{val:.2f}", ha="center", va="bottom", fontsize=9)
-
-            plt.show()
-
-        # cleanup temp file if we created one
-        if "fp" in locals():
-            os.unlink(native_audio_path)
+            plot_word_scores(word_scores)
 
         return word_scores, sentence_score
     except Exception as e:
         import logging
         logging.error(f"Accent scoring failed: {e}")
+        if strict or isinstance(e, WavLMConfigError):
+            raise
         # Return a below average score and empty word_scores
         return [], 0.25
 
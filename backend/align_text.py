@@ -1,50 +1,192 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
+import queue
 import re
+import numpy as np
 import soundfile as sf
 import torch
+from whisper.audio import SAMPLE_RATE, load_audio
 from whisper_timestamped import load_model, transcribe
+import model_registry
+
+# ASR engine for the transcript and word timings:
+# "whisper_timestamped" (PyTorch, fp32) or "faster_whisper" (CTranslate2, quantized)
+ASR_BACKEND = os.getenv("ASR_BACKEND", "whisper_timestamped").lower()
+ASR_COMPUTE_TYPE = os.getenv("ASR_COMPUTE_TYPE", "int8")  # faster_whisper only: int8, int8_float16, float16, float32
+ASR_BACKENDS = ("whisper_timestamped", "faster_whisper")
+
+# Chunked transcription: recordings longer than ASR_CHUNK_SECONDS are cut at silences
+# into chunks of at most that length and transcribed in parallel (0 = single pass)
+ASR_CHUNK_SECONDS = float(os.getenv("ASR_CHUNK_SECONDS", "0"))
+ASR_CHUNK_WORKERS = int(os.getenv("ASR_CHUNK_WORKERS", "2"))  # model copies transcribing at once
+SILENCE_DB = float(os.getenv("ASR_SILENCE_DB", "-35"))  # frame energy below the loud frames that counts as silence
+MIN_SILENCE_S = 0.3
 
 def load_wav_info(path: str):
     """Return length (s) and sample‑rate for sanity checks."""
     info = sf.info(path)
     return info.frames / info.samplerate, info.samplerate
 
-def sentence_chunks(words, sent_end_re=r"[.!?…]+"):
+def sentence_chunks(words, sent_end_re=r"[.!?…]+", with_words: bool = False):
     """
     Group word dicts (with 'text','start','end') into sentences.
-    Yields (sentence_text, start_t, end_t).
+    Yields (sentence_text, start_t, end_t), plus the sentence's word dicts
+    as a fourth item when `with_words` is set.
     """
-    buf, start_t = [], None
+    buf, group, start_t = [], [], None
     for w in words:
         if start_t is None:
             start_t = w["start"]
         buf.append(w["text"])
+        group.append(w)
         if re.search(sent_end_re, w["text"]):
             end_t = w["end"]
-            yield " ".join(buf).strip(), start_t, end_t
-            buf, start_t = [], None
+            chunk = (" ".join(buf).strip(), start_t, end_t)
+            yield chunk + (group,) if with_words else chunk
+            buf, group, start_t = [], [], None
     # trailing words without punctuation
     if buf:
-        yield " ".join(buf).strip(), start_t, words[-1]["end"]
+        chunk = (" ".join(buf).strip(), start_t, words[-1]["end"])
+        yield chunk + (group,) if with_words else chunk
+
+DEFAULT_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+def _load_faster_whisper(model_name: str, device: str, compute_type: str):
+    from faster_whisper import WhisperModel  # optional: pip install faster-whisper==1.2.1
+    return WhisperModel(model_name, device=device, compute_type=compute_type)
+
+def timeline_model(model_name: str = "medium.en", device: str = DEFAULT_DEVICE, slot: int = 0,
+                   backend: str = ASR_BACKEND) -> str:
+    """
+    Register (once) and return the model-registry name of a word-timestamp ASR model.
+
+    whisper_timestamped installs hooks on the model for every call, so one copy
+    can only transcribe one thing at a time; chunked transcription gives each
+    parallel worker its own `slot` (its own copy). faster_whisper models are
+    treated the same way.
+    """
+    if backend == "whisper_timestamped":
+        name, loader = f"whisper_timestamped:{model_name}:{device}", lambda: load_model(model_name, device=device)
+    elif backend == "faster_whisper":
+        name = f"faster_whisper:{model_name}:{device}:{ASR_COMPUTE_TYPE}"
+        loader = lambda: _load_faster_whisper(model_name, device, ASR_COMPUTE_TYPE)
+    else:
+        raise ValueError(f"Unsupported ASR backend: {backend} (expected one of {ASR_BACKENDS})")
+    return model_registry.register(name + (f":{slot}" if slot else ""), loader, thread_safe=False)
+
+def transcribe_audio(model, audio, backend: str = ASR_BACKEND) -> list[dict]:
+    """
+    Word dicts ('text', 'start', 'end' in seconds of `audio`) from either backend.
+    `audio` is a file path or a 16 kHz mono float32 array.
+    """
+    if backend == "faster_whisper":
+        segments, _ = model.transcribe(audio, language="en", word_timestamps=True, vad_filter=True)
+        return [{"text": w.word.strip(), "start": w.start, "end": w.end}
+                for seg in segments for w in seg.words]
+    # we only need word‑level info, so set `return_segments=True`
+    result = transcribe(model, audio, language="en", vad=True)
+    return [w for seg in result["segments"] for w in seg["words"]]
+
+def find_silences(audio: np.ndarray, sr: int = SAMPLE_RATE, frame_s: float = 0.03,
+                  silence_db: float = SILENCE_DB, min_silence_s: float = MIN_SILENCE_S):
+    """
+    Energy-based VAD: return (start, end) seconds of the pauses in `audio`.
+    A frame is silent when its energy is `silence_db` below the loud frames
+    (95th percentile), so the threshold follows the recording level.
+    """
+    hop = int(frame_s * sr)
+    n = len(audio) // hop
+    if n == 0:
+        return []
+    frames = audio[: n * hop].reshape(n, hop)
+    db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    silent = db < np.percentile(db, 95) + silence_db
+    silences, start = [], None
+    for i, s in enumerate(np.append(silent, False)):
+        if s and start is None:
+            start = i
+        elif not s and start is not None:
+            if (i - start) * frame_s >= min_silence_s:
+                silences.append((start * frame_s, i * frame_s))
+            start = None
+    return silences
+
+def plan_chunks(duration: float, silences, max_chunk_s: float):
+    """
+    Cut [0, duration] into chunks of at most `max_chunk_s`, each ending in the
+    middle of the latest pause in its second half (or hard-cut if there is none).
+    """
+    chunks, cursor = [], 0.0
+    while duration - cursor > max_chunk_s:
+        limit = cursor + max_chunk_s
+        cuts = [(a + b) / 2 for a, b in silences if cursor + max_chunk_s / 2 <= (a + b) / 2 <= limit]
+        cut = cuts[-1] if cuts else limit
+        chunks.append((cursor, cut))
+        cursor = cut
+    chunks.append((cursor, duration))
+    return chunks
+
+def transcribe_words(audio_path: str, model_name: str = "medium.en", device: str = DEFAULT_DEVICE,
+                     chunk_s: float = ASR_CHUNK_SECONDS, workers: int = ASR_CHUNK_WORKERS,
+                     backend: str = ASR_BACKEND):
+    """
+    Word dicts ('text', 'start', 'end' in seconds of the whole recording).
+
+    With `chunk_s` > 0 a longer recording is split at silences into chunks of
+    at most `chunk_s` seconds that are transcribed in parallel by `workers`
+    model copies; the word times are shifted back to global time.
+    `backend` selects the ASR engine (see ASR_BACKEND).
+    """
+    if chunk_s <= 0 or load_wav_info(audio_path)[0] <= chunk_s:
+        with model_registry.use(timeline_model(model_name, device, backend=backend)) as model:
+            return transcribe_audio(model, audio_path, backend)
+
+    audio = load_audio(audio_path)  # 16 kHz mono float32
+    chunks = plan_chunks(len(audio) / SAMPLE_RATE, find_silences(audio), chunk_s)
+    slots: queue.Queue[int] = queue.Queue()
+    for slot in range(max(1, min(workers, len(chunks)))):
+        slots.put(slot)
+
+    def run(chunk):
+        t0, t1 = chunk
+        slot = slots.get()
+        try:
+            with model_registry.use(timeline_model(model_name, device, slot, backend)) as model:
+                words = transcribe_audio(model, audio[int(t0 * SAMPLE_RATE): int(t1 * SAMPLE_RATE)], backend)
+        finally:
+            slots.put(slot)
+        return [dict(w, start=w["start"] + t0, end=w["end"] + t0) for w in words]
+
+    with ThreadPoolExecutor(max_workers=slots.qsize()) as pool:
+        return [w for words in pool.map(run, chunks) for w in words]
 
 def make_timeline(audio_path: str,
                   model_name: str = "medium.en",
-                  device: str = "cuda" if torch.cuda.is_available() else "cpu"):
+                  device: str = DEFAULT_DEVICE,
+                  chunk_s: float = ASR_CHUNK_SECONDS,
+                  workers: int = ASR_CHUNK_WORKERS,
+                  backend: str = ASR_BACKEND):
     """
-    Return list of dicts: id, sentence_text, audio_timeline
+    Return list of dicts: id, sentence_text, audio_timeline, words
+
+    `words` keeps the word-level timestamps (absolute seconds in the
+    conversation) so scoring can reuse them instead of re-transcribing.
+    See `transcribe_words` for the chunked mode (`chunk_s`, `workers`) and `backend`.
     """
-    model = load_model(model_name, device=device)
-    # we only need word‑level info, so set `return_segments=True`
-    result = transcribe(model, audio_path, language="en", vad=True)
-    words = [w for seg in result["segments"] for w in seg["words"]]
+    words = transcribe_words(audio_path, model_name, device, chunk_s, workers, backend)
 
     timeline: list[dict] = []
-    for idx, (text, t0, t1) in enumerate(sentence_chunks(words), start=1):
+    for idx, (text, t0, t1, group) in enumerate(sentence_chunks(words, with_words=True), start=1):
         timeline.append(
             {"id": idx,
              "sentence_text": text,
-             "audio_timeline": {"start": round(t0, 2), "end": round(t1, 2)}}
+             "audio_timeline": {"start": round(t0, 2), "end": round(t1, 2)},
+             "words": [
+                 {"word": w["text"].strip(), "start": round(w["start"], 3), "end": round(w["end"], 3)}
+                 for w in group
+             ]}
         )
     return timeline
 
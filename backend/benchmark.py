@@ -0,0 +1,338 @@
+"""
+Offline benchmarks on the sample recordings in audio_samples/.
+
+    python benchmark.py chunking [--chunk 8] [--workers 2]
+    python benchmark.py asr [--backend faster_whisper] [--reference whisper_timestamped]
+    python benchmark.py wavlm [--backends large-int8 large-onnx base-plus] [--reference large]
+    python benchmark.py frames [--window 10] [--overlap 2]
+
+`chunking` transcribes every sample in a single pass and in chunked mode
+(see `align_text.transcribe_words`) and checks that both produce the same
+sentences with boundaries within --tolerance seconds.
+
+`asr` transcribes every sample with two ASR backends (see
+`align_text.ASR_BACKEND`) and reports each one's real-time factor (seconds of
+compute per second of audio, models already loaded) and how well the
+candidate's word timings agree with the reference's.
+
+`wavlm` is a regression report for the WavLM embedding backends (see
+`accent_check.WAVLM_BACKEND`): every sentence of every sample is scored with
+the reference (fp32 large) and with each candidate, on the same transcript,
+and the candidates' word_scores are compared with the reference's: mean and
+max absolute difference, correlation, and how often a word lands in the same
+colour band of the UI (>= .5 / >= .3 / below). Memory is reported as the size
+of each model's weights (state_dict tensors, which include packed int8 Linear
+weights, or the ONNX file) and as the resident memory its load added. A
+backend that fails to score a sentence fails the report instead of being
+compared on fallback scores.
+
+`frames` checks the windowed frame encoder of the frame scoring engine
+(`accent_check.encode_frames`): every sample is encoded in one pass and in
+--window second windows, and the two must have the same number of frames and
+line up (the best-matching frame offset is 0).
+"""
+import argparse
+import difflib
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import align_text
+import model_registry
+
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / "audio_samples"
+
+
+def sample_files(samples_dir: Path) -> list[Path]:
+    files = sorted(samples_dir.glob("*.wav"))
+    if not files:
+        sys.exit(f"No .wav samples found in {samples_dir}")
+    return files
+
+
+def normalize_words(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+def compare_timelines(reference: list[dict], candidate: list[dict], tolerance: float) -> dict:
+    """
+    How well `candidate` sentences match `reference`: same count, same words
+    per sentence and start/end within `tolerance` seconds.
+    """
+    same_text = len(reference) == len(candidate) and all(
+        normalize_words(r["sentence_text"]) == normalize_words(c["sentence_text"])
+        for r, c in zip(reference, candidate)
+    )
+    drift = max(
+        (abs(r["audio_timeline"][k] - c["audio_timeline"][k])
+         for r, c in zip(reference, candidate) for k in ("start", "end")),
+        default=0.0,
+    )
+    return {
+        "sentences": (len(reference), len(candidate)),
+        "same_text": same_text,
+        "max_boundary_drift": round(drift, 3),
+        "consistent": same_text and drift <= tolerance,
+    }
+
+
+def compare_words(reference: list[dict], candidate: list[dict], tolerance: float) -> dict:
+    """
+    Align the two word sequences by text and compare the timings of matched
+    words: share of reference words matched, mean start/end offset and share
+    of matched words whose start and end are both within `tolerance` seconds.
+    """
+    ref_text = [normalize_words(w["text"]) for w in reference]
+    cand_text = [normalize_words(w["text"]) for w in candidate]
+    matcher = difflib.SequenceMatcher(a=ref_text, b=cand_text, autojunk=False)
+    pairs = [(reference[block.a + k], candidate[block.b + k])
+             for block in matcher.get_matching_blocks() for k in range(block.size)]
+    if not pairs:
+        return {"matched": 0.0, "start_diff": None, "end_diff": None, "within": 0.0}
+    start_diff = [abs(r["start"] - c["start"]) for r, c in pairs]
+    end_diff = [abs(r["end"] - c["end"]) for r, c in pairs]
+    return {
+        "matched": len(pairs) / max(1, len(reference)),
+        "start_diff": sum(start_diff) / len(pairs),
+        "end_diff": sum(end_diff) / len(pairs),
+        "within": sum(s <= tolerance and e <= tolerance for s, e in zip(start_diff, end_diff)) / len(pairs),
+    }
+
+
+def score_band(score: float) -> int:
+    """Colour band of a word score, as in accent_check.plot_word_scores."""
+    return 2 if score >= .5 else 1 if score >= .3 else 0
+
+
+def pearson(xs: list[float], ys: list[float]) -> float | None:
+    n = len(xs)
+    if n < 2:
+        return None
+    mx, my = sum(xs) / n, sum(ys) / n
+    cov = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    vx = sum((x - mx) ** 2 for x in xs) ** .5
+    vy = sum((y - my) ** 2 for y in ys) ** .5
+    return cov / (vx * vy) if vx and vy else None
+
+
+def compare_scores(reference: list[tuple], candidate: list[tuple]) -> dict:
+    """
+    Compare per-sentence (word_scores, sentence_score) results of two backends
+    on the same sentences.
+    """
+    ref_words, cand_words, sent_diff = [], [], []
+    for (ref_ws, ref_s), (cand_ws, cand_s) in zip(reference, candidate):
+        for r, c in zip(ref_ws, cand_ws):
+            ref_words.append(r["score"])
+            cand_words.append(c["score"])
+        sent_diff.append(abs(ref_s - cand_s))
+    diffs = [abs(r - c) for r, c in zip(ref_words, cand_words)]
+    return {
+        "words": len(diffs),
+        "mean_abs_diff": sum(diffs) / len(diffs) if diffs else None,
+        "max_abs_diff": max(diffs, default=None),
+        "pearson": pearson(ref_words, cand_words),
+        "same_band": sum(score_band(r) == score_band(c) for r, c in zip(ref_words, cand_words)) / len(diffs)
+        if diffs else None,
+        "sentence_mean_abs_diff": sum(sent_diff) / len(sent_diff) if sent_diff else None,
+    }
+
+
+def weight_bytes(model) -> int:
+    """Bytes of a model's weights: its state_dict tensors, or the file of an ONNX session."""
+    import torch
+    from wavlm_onnx import OnnxWavLM
+
+    if isinstance(model, OnnxWavLM):
+        return model.path.stat().st_size
+
+    def size(value) -> int:
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):  # packed params of dynamically quantized layers
+            return sum(size(v) for v in value)
+        return 0
+
+    return sum(size(v) for v in model.state_dict().values())
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def bench_chunking(args) -> bool:
+    ok = True
+    print(f"{'sample':40} {'len':>6} {'single':>8} {'chunked':>8} {'sents':>7} {'drift':>6}  consistent")
+    for path in sample_files(args.samples):
+        duration = align_text.load_wav_info(str(path))[0]
+        single, t_single = timed(align_text.make_timeline, str(path), args.model, chunk_s=0)
+        chunked, t_chunked = timed(align_text.make_timeline, str(path), args.model,
+                                   chunk_s=args.chunk, workers=args.workers)
+        cmp = compare_timelines(single, chunked, args.tolerance)
+        ok &= cmp["consistent"]
+        print(f"{path.stem[:40]:40} {duration:5.1f}s {t_single:7.1f}s {t_chunked:7.1f}s "
+              f"{cmp['sentences'][0]:>3}/{cmp['sentences'][1]:<3} {cmp['max_boundary_drift']:5.2f}s  {cmp['consistent']}")
+    return ok
+
+
+def bench_asr(args) -> bool:
+    for backend in (args.reference, args.backend):
+        model_registry.get(align_text.timeline_model(args.model, backend=backend))  # load outside the timings
+    total = {"audio": 0.0, args.reference: 0.0, args.backend: 0.0}
+    results = []
+    print(f"{'sample':40} {'len':>6} {'ref RTF':>8} {'cand RTF':>8} {'matched':>8} "
+          f"{'Δstart':>7} {'Δend':>7} {'within':>7}")
+    for path in sample_files(args.samples):
+        duration = align_text.load_wav_info(str(path))[0]
+        ref, t_ref = timed(align_text.transcribe_words, str(path), args.model, chunk_s=0, backend=args.reference)
+        cand, t_cand = timed(align_text.transcribe_words, str(path), args.model, chunk_s=0, backend=args.backend)
+        cmp = compare_words(ref, cand, args.tolerance)
+        results.append(cmp)
+        total["audio"] += duration
+        total[args.reference] += t_ref
+        total[args.backend] += t_cand
+        fmt = lambda v: f"{v:6.3f}s" if v is not None else "    n/a"
+        print(f"{path.stem[:40]:40} {duration:5.1f}s {t_ref / duration:8.3f} {t_cand / duration:8.3f} "
+              f"{cmp['matched']:8.1%} {fmt(cmp['start_diff'])} {fmt(cmp['end_diff'])} {cmp['within']:7.1%}")
+    matched = sum(r["matched"] for r in results) / len(results)
+    within = sum(r["within"] for r in results) / len(results)
+    print(f"\nRTF {args.reference}: {total[args.reference] / total['audio']:.3f}, "
+          f"{args.backend}: {total[args.backend] / total['audio']:.3f} "
+          f"(speed-up {total[args.reference] / max(total[args.backend], 1e-9):.2f}x)")
+    print(f"Words matched: {matched:.1%}, matched words within {args.tolerance}s: {within:.1%}")
+    return True
+
+
+def bench_wavlm(args) -> bool:
+    import accent_check
+
+    sr = 16000
+    backends = [args.reference] + [b for b in args.backends if b != args.reference]
+    for backend in backends:
+        model_registry.get(accent_check.wavlm_model(backend))  # load outside the timings
+    # one transcript per sample, shared by every backend
+    samples = []
+    for path in sample_files(args.samples):
+        samples.append((accent_check.load_audio(str(path), sr), align_text.make_timeline(str(path), args.model)))
+    results, seconds = {}, {}
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            scores, t0 = [], time.perf_counter()
+            try:
+                for n, (conv, timeline) in enumerate(samples):
+                    for sentence in timeline:
+                        start, end = sentence["audio_timeline"]["start"], sentence["audio_timeline"]["end"]
+                        words = [{"word": w["word"], "start": max(0.0, w["start"] - start),
+                                  "end": max(0.0, w["end"] - start)} for w in sentence["words"]]
+                        scores.append(accent_check.score_sentence_words(
+                            conv[:, int(start * sr): int(end * sr)], words,
+                            native_txt=sentence["sentence_text"],
+                            native_out_path=str(Path(tmp) / f"{n}_{sentence['id']}_native.wav"),
+                            sr=sr, tts_engine=args.tts, visualize=False, wavlm_backend=backend, strict=True,
+                        ))
+            except Exception as e:
+                # a fallback score would only measure the fallback
+                print(f"{backend}: scoring failed, not compared: {e}")
+                ok = False
+                if backend == args.reference:
+                    return False
+                continue
+            seconds[backend] = time.perf_counter() - t0
+            results[backend] = scores
+
+    models = model_registry.stats()
+    fmt = lambda v, spec=".3f": format(v, spec) if v is not None else "n/a"
+    print(f"{'backend':16} {'seconds':>8} {'speed-up':>8} {'weights MB':>10} {'RSS MB':>7} {'words':>6} "
+          f"{'mean|Δ|':>8} {'max|Δ|':>7} {'r':>6} {'band':>6} {'sent|Δ|':>8}")
+    for backend in results:
+        cmp = compare_scores(results[args.reference], results[backend])
+        if backend != args.reference and (cmp["same_band"] or 0) < args.min_band_agreement:
+            ok = False
+        name = accent_check.wavlm_model(backend)
+        weights_mb = weight_bytes(model_registry.get(name)) / 2 ** 20
+        rss_mb = models[name]["rss_delta_bytes"] / 2 ** 20
+        print(f"{backend:16} {seconds[backend]:8.1f} {seconds[args.reference] / max(seconds[backend], 1e-9):7.2f}x "
+              f"{weights_mb:10.0f} {rss_mb:7.0f} {cmp['words']:6d} {fmt(cmp['mean_abs_diff']):>8} "
+              f"{fmt(cmp['max_abs_diff']):>7} {fmt(cmp['pearson']):>6} {fmt(cmp['same_band'], '.1%'):>6} "
+              f"{fmt(cmp['sentence_mean_abs_diff']):>8}")
+    return ok
+
+
+def frame_alignment(single, windowed, max_lag: int = 3) -> dict:
+    """Length match, per-frame cosine similarity and best frame offset of two (frames, D) encodings."""
+    import torch
+
+    def similarity(lag: int) -> float:
+        a = single[max(0, lag):single.shape[0] + min(0, lag)]
+        b = windowed[max(0, -lag):windowed.shape[0] - max(0, lag)]
+        n = min(a.shape[0], b.shape[0])
+        return torch.nn.functional.cosine_similarity(a[:n], b[:n], dim=-1).mean().item()
+
+    lags = {lag: similarity(lag) for lag in range(-max_lag, max_lag + 1)}
+    best = max(lags, key=lags.get)
+    return {"frames": (single.shape[0], windowed.shape[0]), "cosine": lags[0], "best_lag": best,
+            "aligned": single.shape[0] == windowed.shape[0] and best == 0}
+
+
+def bench_frames(args) -> bool:
+    import accent_check
+
+    sr = 16000
+    ok = True
+    print(f"{'sample':40} {'len':>6} {'single':>7} {'windowed':>8} {'cosine':>7} {'lag':>4}  aligned")
+    with model_registry.use(accent_check.wavlm_model()) as wavlm:
+        for path in sample_files(args.samples):
+            wav = accent_check.load_audio(str(path), sr)
+            single = accent_check.encode_frames(wavlm, wav, sr, window_s=wav.shape[-1] / sr + 1)
+            windowed = accent_check.encode_frames(wavlm, wav, sr, window_s=args.window, overlap_s=args.overlap)
+            cmp = frame_alignment(single, windowed)
+            ok &= cmp["aligned"]
+            print(f"{path.stem[:40]:40} {wav.shape[-1] / sr:5.1f}s {cmp['frames'][0]:7d} {cmp['frames'][1]:8d} "
+                  f"{cmp['cosine']:7.3f} {cmp['best_lag']:4d}  {cmp['aligned']}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=Path, default=SAMPLES_DIR, help="Directory of .wav samples")
+    parser.add_argument("--model", default="medium.en", help="Whisper model")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    chunking = sub.add_parser("chunking", help="Chunked vs single-pass transcription")
+    chunking.add_argument("--chunk", type=float, default=8.0, help="Max chunk length in seconds")
+    chunking.add_argument("--workers", type=int, default=2, help="Parallel model copies")
+    chunking.add_argument("--tolerance", type=float, default=0.5, help="Allowed boundary drift in seconds")
+    chunking.set_defaults(run=bench_chunking)
+
+    asr = sub.add_parser("asr", help="RTF and word-timing agreement of two ASR backends")
+    asr.add_argument("--backend", default="faster_whisper", choices=align_text.ASR_BACKENDS, help="Candidate backend")
+    asr.add_argument("--reference", default="whisper_timestamped", choices=align_text.ASR_BACKENDS,
+                     help="Reference backend")
+    asr.add_argument("--tolerance", type=float, default=0.1, help="Word timing tolerance in seconds")
+    asr.set_defaults(run=bench_asr)
+
+    wavlm = sub.add_parser("wavlm", help="word_scores of WavLM backends against the fp32 large reference")
+    wavlm.add_argument("--backends", nargs="+", default=["large-int8", "large-onnx", "base-plus"],
+                       help="Candidate WAVLM_BACKEND values")
+    wavlm.add_argument("--reference", default="large", help="Reference WAVLM_BACKEND")
+    wavlm.add_argument("--tts", default="gtts", help="TTS engine for the native references")
+    wavlm.add_argument("--min-band-agreement", type=float, default=0.9,
+                       help="Fail if a candidate puts fewer words in the reference's colour band")
+    wavlm.set_defaults(run=bench_wavlm)
+
+    frames = sub.add_parser("frames", help="Windowed vs single-pass frame encoding")
+    frames.add_argument("--window", type=float, default=10.0, help="Window length in seconds")
+    frames.add_argument("--overlap", type=float, default=2.0, help="Window overlap in seconds")
+    frames.set_defaults(run=bench_frames)
+
+    args = parser.parse_args()
+    sys.exit(0 if args.run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
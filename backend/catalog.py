@@ -0,0 +1,239 @@
+"""
+Indexed catalog of conversations (SQLite, <data root>/catalog.db).
+
+One row per conversation with the fields the conversation list needs (id,
+filename, sha256, upload time, action, summary). `result_store` upserts the
+row whenever a conversation's metadata changes, so listing never opens the
+conversation folders. Paging, sorting by upload time and filtering by state
+are index lookups, so the cost does not grow with the number of conversations.
+
+The first time a catalog is opened it is backfilled by scanning the data root
+once; `rebuild()` repeats that scan on demand.
+
+The sha256 of every upload is indexed too, so `find_duplicate` can spot a
+re-uploaded recording; `stats()` reports how often that happens. Uploads hash
+the raw bytes received ("sha256_of": "upload" in their metadata); older
+conversations hashed the converted WAV and are indexed with hash_of = "wav".
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterable
+
+CATALOG_FILE = "catalog.db"
+# joins the actions of stages running at the same time, e.g. "scoring + checking grammar"
+ACTION_SEPARATOR = " + "
+COLUMNS = ("conversation_id", "filename", "sha256", "uploaded_at", "action", "summary")
+
+_lock = threading.RLock()
+_backfill_lock = threading.Lock()  # one scan at a time; never taken while holding _lock
+_conns: dict[str, sqlite3.Connection] = {}
+_counters = {"dedup_lookups": 0, "dedup_hits": 0}
+
+
+def _connect(root: Path) -> sqlite3.Connection:
+    """Open (and create) the catalog of `root`. Caller holds _lock."""
+    key = str(Path(root).resolve())
+    conn = _conns.get(key)
+    if conn is not None:
+        return conn
+    Path(root).mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(Path(root) / CATALOG_FILE), check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS conversations (
+               conversation_id TEXT PRIMARY KEY,
+               filename TEXT,
+               sha256 TEXT,
+               uploaded_at TEXT NOT NULL DEFAULT '',
+               action TEXT,
+               summary TEXT,
+               updated_at REAL NOT NULL,
+               hash_of TEXT NOT NULL DEFAULT 'wav')"""
+    )
+    if "hash_of" not in {col[1] for col in conn.execute("PRAGMA table_info(conversations)")}:
+        # catalogs from before hash_of existed: add it and re-index every folder
+        conn.execute("ALTER TABLE conversations ADD COLUMN hash_of TEXT NOT NULL DEFAULT 'wav'")
+        conn.execute("DELETE FROM conversations")
+        conn.execute("DELETE FROM catalog_meta WHERE key = 'backfilled'")
+    conn.execute("CREATE INDEX IF NOT EXISTS conversations_uploaded_at ON conversations(uploaded_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS conversations_action ON conversations(action, uploaded_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS conversations_sha256 ON conversations(sha256)")
+    conn.execute("DROP INDEX IF EXISTS conversations_hash_of")
+    conn.execute("CREATE INDEX IF NOT EXISTS conversations_hash_of_action ON conversations(hash_of, action)")
+    conn.commit()
+    _conns[key] = conn
+    return conn
+
+
+def _backfilled(conn: sqlite3.Connection) -> bool:
+    with _lock:
+        return conn.execute("SELECT 1 FROM catalog_meta WHERE key = 'backfilled'").fetchone() is not None
+
+
+def _catalog(root: Path) -> sqlite3.Connection:
+    """
+    Connection to the catalog of `root`, backfilled the first time it is opened.
+    Must not be called with _lock held: the backfill reads conversation folders.
+    """
+    with _lock:
+        conn = _connect(root)
+    if not _backfilled(conn):
+        with _backfill_lock:
+            if not _backfilled(conn):
+                _backfill(root, conn)
+    return conn
+
+
+def _row(conversation_id: str, meta: dict) -> tuple:
+    return (conversation_id, meta.get("filename"), meta.get("sha256"), meta.get("uploaded_at", ""),
+            meta.get("action"), meta.get("summary", ""), time.time(), meta.get("sha256_of", "wav"))
+
+
+def _backfill(root: Path, conn: sqlite3.Connection) -> int:
+    """
+    Index every conversation folder under `root`. Caller must not hold _lock.
+
+    Folders are read without their locks (a writer may hold one while it
+    upserts) and _lock is only taken for the insert. Rows upserted meanwhile
+    are newer than what the scan read, so they are kept.
+    """
+    from result_store import ResultStore  # result_store imports this module
+    rows = []
+    for child in Path(root).iterdir():
+        store = ResultStore(child)
+        if not child.is_dir() or not store.exists():
+            continue
+        try:
+            meta = store.peek_meta()
+        except Exception as e:
+            logging.error(f"Skipping unreadable conversation {child.name}: {e}")
+            continue
+        rows.append(_row(meta.get("conversation_id", child.name), meta))
+    with _lock:
+        conn.executemany("INSERT OR IGNORE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO catalog_meta VALUES ('backfilled', ?)", (str(time.time()),))
+        conn.commit()
+    logging.info(f"Catalog backfilled with {len(rows)} conversations from {root}")
+    return len(rows)
+
+
+def upsert(root: Path, conversation_id: str, meta: dict) -> None:
+    """Record the latest metadata of a conversation. Never raises."""
+    try:
+        conn = _catalog(root)
+        with _lock:
+            conn.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         _row(conversation_id, meta))
+            conn.commit()
+    except sqlite3.Error as e:
+        logging.error(f"Catalog update failed for {conversation_id}: {e}")
+
+
+def remove(root: Path, conversation_id: str) -> None:
+    conn = _catalog(root)
+    with _lock:
+        conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        conn.commit()
+
+
+def rebuild(root: Path) -> int:
+    """Drop the catalog rows and rescan the data root. Returns the number indexed."""
+    with _backfill_lock:
+        with _lock:
+            conn = _connect(root)
+            conn.execute("DELETE FROM conversations")
+            conn.execute("DELETE FROM catalog_meta WHERE key = 'backfilled'")
+            conn.commit()
+        return _backfill(root, conn)
+
+
+def list_conversations(root: Path, states: Iterable[str] | None = None, limit: int | None = None,
+                       offset: int = 0, newest_first: bool = True) -> tuple[list[dict[str, Any]], int]:
+    """
+    One page of conversations, sorted by upload time.
+
+    :param states: Only include conversations whose action is one of these, or
+        a combined action (see ACTION_SEPARATOR) with one of these among its parts
+    :param limit: Page size (None for all)
+    :param offset: Rows to skip
+    :param newest_first: Sort by upload time, newest first (default) or oldest first
+    :return: (rows, total matching rows)
+    """
+    where, params = "", []
+    states = list(states or [])
+    if states:
+        # a combined action matches each of its parts: look for " + part + " in " + action + "
+        part = f"instr('{ACTION_SEPARATOR}' || action || '{ACTION_SEPARATOR}', '{ACTION_SEPARATOR}' || ? || '{ACTION_SEPARATOR}') > 0"
+        where = (f"WHERE action IN ({', '.join('?' * len(states))}) "
+                 f"OR (action LIKE '%{ACTION_SEPARATOR}%' AND ({' OR '.join([part] * len(states))}))")
+        params.extend(states + states)
+    order = "DESC" if newest_first else "ASC"
+    conn = _catalog(root)
+    with _lock:
+        total = conn.execute(f"SELECT COUNT(*) FROM conversations {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM conversations {where} "
+            f"ORDER BY uploaded_at {order}, conversation_id {order} LIMIT ? OFFSET ?",
+            params + [limit if limit is not None else -1, max(0, offset)],
+        ).fetchall()
+    return [dict(zip(COLUMNS, row)) for row in rows], total
+
+
+def unsettled(root: Path) -> list[str]:
+    """Ids of conversations whose action is neither finished nor error, oldest upload first."""
+    conn = _catalog(root)
+    with _lock:
+        rows = conn.execute(
+            "SELECT conversation_id FROM conversations "
+            "WHERE action IS NULL OR action NOT IN ('finished', 'error') "
+            "ORDER BY uploaded_at ASC, conversation_id ASC"
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def has_legacy_hashes(root: Path) -> bool:
+    """
+    Whether any finished conversation (the only kind `find_duplicate` matches by
+    default) is indexed by the hash of its converted WAV.
+    """
+    conn = _catalog(root)
+    with _lock:
+        return conn.execute(
+            "SELECT 1 FROM conversations WHERE hash_of = 'wav' AND action = 'finished' LIMIT 1"
+        ).fetchone() is not None
+
+
+def find_duplicate(root: Path, sha256: str, exclude: str | None = None,
+                   states: Iterable[str] = ("finished",), wav_sha256: str | None = None) -> dict[str, Any] | None:
+    """
+    Most recent conversation with the same upload hash, or None.
+
+    :param exclude: Conversation id to ignore (the upload being checked)
+    :param states: Only match conversations whose action is one of these
+    :param wav_sha256: Hash of the converted WAV, matched against conversations
+        indexed before uploads were hashed raw (see `has_legacy_hashes`)
+    """
+    states = list(states)
+    conn = _catalog(root)
+    with _lock:
+        row = conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM conversations "
+            f"WHERE ((sha256 = ? AND hash_of = 'upload') OR (sha256 = ? AND hash_of = 'wav')) "
+            f"AND conversation_id != ? AND action IN ({', '.join('?' * len(states))}) "
+            f"ORDER BY uploaded_at DESC LIMIT 1",
+            [sha256, wav_sha256 or "", exclude or ""] + states,
+        ).fetchone()
+        _counters["dedup_lookups"] += 1
+        if row is not None:
+            _counters["dedup_hits"] += 1
+    return dict(zip(COLUMNS, row)) if row is not None else None
+
+
+def stats() -> dict[str, Any]:
+    with _lock:
+        lookups = _counters["dedup_lookups"]
+        return dict(_counters, dedup_hit_rate=round(_counters["dedup_hits"] / lookups, 3) if lookups else None)
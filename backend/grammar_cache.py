@@ -0,0 +1,128 @@
+"""
+Persistent memoization of grammar analysis results (SQLite).
+
+Entries are keyed on the normalized sentence text, provider, model and prompt
+version, so bumping a provider's PROMPT_VERSION (or switching model) makes
+old entries unreachable; they are purged the next time the cache is opened.
+Entries expire after GRAMMAR_CACHE_TTL_DAYS and the least recently used are
+evicted once there are more than GRAMMAR_CACHE_MAX_ENTRIES.
+
+A hit never touches the network. Error results are not cached.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict
+
+ENABLED = os.getenv("GRAMMAR_CACHE", "True").lower() == "true"
+CACHE_PATH = Path(os.getenv("GRAMMAR_CACHE_PATH", "cache/grammar.sqlite3"))
+TTL_SECONDS = float(os.getenv("GRAMMAR_CACHE_TTL_DAYS", "30")) * 86400
+MAX_ENTRIES = int(os.getenv("GRAMMAR_CACHE_MAX_ENTRIES", "100000"))
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+_purged: set[tuple[str, str, int]] = set()
+_counters = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0}
+
+
+def normalize_text(text: str) -> str:
+    """Unicode- and whitespace-normalize text; case and punctuation are kept."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(text: str, provider: str, model: str, prompt_version: int) -> str:
+    payload = json.dumps([normalize_text(text), provider, model, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(CACHE_PATH), check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            """CREATE TABLE IF NOT EXISTS grammar_cache (
+                   key TEXT PRIMARY KEY,
+                   provider TEXT NOT NULL,
+                   model TEXT NOT NULL,
+                   prompt_version INTEGER NOT NULL,
+                   result TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_used REAL NOT NULL)"""
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS grammar_cache_last_used ON grammar_cache(last_used)")
+        _conn.commit()
+    return _conn
+
+
+def _purge_stale_versions(conn: sqlite3.Connection, provider: str, model: str, prompt_version: int) -> None:
+    """Drop this provider's entries written by another model or prompt version."""
+    if (provider, model, prompt_version) in _purged:
+        return
+    conn.execute(
+        "DELETE FROM grammar_cache WHERE provider = ? AND (model != ? OR prompt_version != ?)",
+        (provider, model, prompt_version),
+    )
+    conn.commit()
+    _purged.add((provider, model, prompt_version))
+
+
+def get(text: str, provider: str, model: str, prompt_version: int) -> Dict[str, Any] | None:
+    """Cached result for `text`, or None on a miss (or expired entry)."""
+    key = cache_key(text, provider, model, prompt_version)
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        _purge_stale_versions(conn, provider, model, prompt_version)
+        row = conn.execute(
+            "SELECT result, created_at FROM grammar_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and TTL_SECONDS > 0 and now - row[1] > TTL_SECONDS:
+            conn.execute("DELETE FROM grammar_cache WHERE key = ?", (key,))
+            conn.commit()
+            _counters["expired"] += 1
+            row = None
+        if row is None:
+            _counters["misses"] += 1
+            return None
+        conn.execute("UPDATE grammar_cache SET last_used = ? WHERE key = ?", (now, key))
+        conn.commit()
+        _counters["hits"] += 1
+        return json.loads(row[0])
+
+
+def put(text: str, provider: str, model: str, prompt_version: int, result: Dict[str, Any]) -> None:
+    """Store a successful result; error results (no corrected text) are skipped."""
+    if not result.get("corrected_text"):
+        return
+    key = cache_key(text, provider, model, prompt_version)
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO grammar_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, provider, model, prompt_version, json.dumps(result, ensure_ascii=False), now, now),
+        )
+        _counters["stores"] += 1
+        count = conn.execute("SELECT COUNT(*) FROM grammar_cache").fetchone()[0]
+        if count > MAX_ENTRIES:
+            excess = count - MAX_ENTRIES
+            conn.execute(
+                "DELETE FROM grammar_cache WHERE key IN "
+                "(SELECT key FROM grammar_cache ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            _counters["evictions"] += excess
+        conn.commit()
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        return dict(_counters, hit_rate=round(_counters["hits"] / lookups, 3) if lookups else None)
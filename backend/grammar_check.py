@@ -0,0 +1,244 @@
+"""
+Grammar checking for a whole conversation.
+
+Dispatches to the configured provider (`grammar_check_gemini` or
+`grammar_check_openai`) and fans sentences out over a bounded thread pool:
+
+• GRAMMAR_CONCURRENCY  ->  max requests in flight per conversation
+• GRAMMAR_TIMEOUT      ->  per-request timeout in seconds
+• GRAMMAR_RETRIES      ->  retries on rate-limit errors, with jittered
+                           exponential backoff starting at GRAMMAR_BACKOFF
+
+With GRAMMAR_BATCH_TOKENS > 0, sentences are packed into multi-sentence
+prompts of roughly that many (estimated) tokens, at most GRAMMAR_BATCH_MAX
+sentences each. A batch whose response cannot be parsed is split in half and
+retried, down to single-sentence requests.
+
+Results are memoized in `grammar_cache`, so a sentence seen before (with the
+same provider, model and prompt version) never reaches the network, and
+duplicate sentences within a conversation are sent only once.
+
+Results always come back in sentence order. Point GEMINI_BASE_URL or
+OPENAI_BASE_URL at a local stub server to exercise this without the real API.
+"""
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Tuple
+
+import grammar_cache
+import grammar_check_gemini, grammar_check_openai
+
+GRAMMAR_CONCURRENCY = int(os.getenv("GRAMMAR_CONCURRENCY", "4"))
+GRAMMAR_TIMEOUT = float(os.getenv("GRAMMAR_TIMEOUT", "30"))
+GRAMMAR_RETRIES = int(os.getenv("GRAMMAR_RETRIES", "4"))
+GRAMMAR_BACKOFF = float(os.getenv("GRAMMAR_BACKOFF", "1.0"))
+GRAMMAR_BACKOFF_MAX = 30.0
+GRAMMAR_BATCH_TOKENS = int(os.getenv("GRAMMAR_BATCH_TOKENS", "0"))  # 0 = one request per sentence
+GRAMMAR_BATCH_MAX = int(os.getenv("GRAMMAR_BATCH_MAX", "20"))
+BATCH_TOKENS_PER_SENTENCE = 120  # expected id, flags and feedback in the response
+
+PROVIDERS = {
+    "gemini": grammar_check_gemini,
+    "openai": grammar_check_openai,
+}
+
+
+def get_provider(name: str):
+    try:
+        return PROVIDERS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported grammar check AI: {name}") from None
+
+
+def backoff_delay(attempt: int, base: float = GRAMMAR_BACKOFF) -> float:
+    """Full-jitter exponential backoff: uniform in [0, base * 2**attempt], capped."""
+    return random.uniform(0, min(GRAMMAR_BACKOFF_MAX, base * 2 ** attempt))
+
+
+def strip_code_fences(response_text: str) -> str:
+    """
+    Extract the JSON payload from a response that may be wrapped in ``` fences.
+    """
+    if "```json" in response_text:
+        json_start = response_text.find("```json") + 7
+        json_end = response_text.find("```", json_start)
+        return response_text[json_start:json_end].strip()
+    if "```" in response_text:
+        json_start = response_text.find("```") + 3
+        json_end = response_text.rfind("```")
+        return response_text[json_start:json_end].strip()
+    return response_text
+
+
+def parse_batch_response(response_text: str, items: List[Tuple[int, str]]) -> Dict[int, Dict[str, Any]]:
+    """
+    Map a batch response (JSON array of objects with an "id") back to the batch's
+    sentence ids. Raises ValueError (json.JSONDecodeError included) if the
+    response is not such an array or misses an id, so `analyze_batch` splits it.
+    """
+    result = json.loads(strip_code_fences(response_text))
+    if not isinstance(result, list):
+        raise ValueError("Batch grammar response is not a JSON array")
+    by_id = {str(entry.get("id")): entry for entry in result if isinstance(entry, dict)}
+    missing = [i for i, _ in items if str(i) not in by_id]
+    if missing:
+        raise ValueError(f"Batch grammar response is missing ids {missing}")
+    return {i: by_id[str(i)] for i, _ in items}
+
+
+def _error_result(error: Exception) -> Dict[str, Any]:
+    return {
+        "is_grammatically_correct": False,
+        "corrected_text": "",
+        "overall_feedback": f"Error analyzing grammar: {str(error)}",
+    }
+
+
+def _format(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "is_grammatically_correct": result.get("is_grammatically_correct", False),
+        "corrected_text": result.get("corrected_text", ""),
+        "overall_feedback": result.get("overall_feedback", ""),
+    }
+
+
+def call_with_retry(provider, fn: Callable[[], Any], retries: int = GRAMMAR_RETRIES) -> Any:
+    """Call `fn`, retrying the provider's rate-limit errors with backoff; other errors propagate."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if not provider.is_rate_limit_error(e) or attempt == retries:
+                raise
+            delay = backoff_delay(attempt)
+            logging.warning(f"Grammar check rate limited, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def analyze_with_retry(provider, text: str, timeout: float = GRAMMAR_TIMEOUT,
+                       retries: int = GRAMMAR_RETRIES) -> Dict[str, Any]:
+    """
+    Run `provider.analyze_grammar`, retrying rate-limit errors with backoff.
+    Never raises: once retries are exhausted an error result is returned.
+    """
+    try:
+        return call_with_retry(provider, lambda: provider.analyze_grammar(text, timeout=timeout), retries)
+    except Exception as e:
+        logging.error(f"Grammar check failed: {e}")
+        return _error_result(e)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def make_batches(items: List[Tuple[int, str]], token_budget: int = GRAMMAR_BATCH_TOKENS,
+                 max_items: int = GRAMMAR_BATCH_MAX) -> List[List[Tuple[int, str]]]:
+    """
+    Greedily pack (id, text) pairs into batches whose estimated prompt plus
+    response size stays within `token_budget`. A sentence larger than the
+    budget gets a batch of its own.
+    """
+    batches, current, used = [], [], 0
+    for item in items:
+        cost = 2 * estimate_tokens(item[1]) + BATCH_TOKENS_PER_SENTENCE
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def analyze_batch(provider, batch: List[Tuple[int, str]], timeout: float = GRAMMAR_TIMEOUT,
+                  retries: int = GRAMMAR_RETRIES) -> Dict[int, Dict[str, Any]]:
+    """
+    Grammar-check a batch in one request. If the response cannot be parsed the
+    batch is split in half and each half retried; single sentences fall back
+    to the per-sentence prompt. Never raises.
+    """
+    if len(batch) == 1:
+        i, text = batch[0]
+        return {i: analyze_with_retry(provider, text, timeout, retries)}
+    try:
+        results = call_with_retry(
+            provider, lambda: provider.check_grammar_batch_with_ai(batch, timeout=timeout), retries,
+        )
+        return {i: _format(r) for i, r in results.items()}
+    except ValueError as e:
+        logging.warning(f"Unparseable grammar batch of {len(batch)}, splitting: {e}")
+        mid = len(batch) // 2
+        return {**analyze_batch(provider, batch[:mid], timeout, retries),
+                **analyze_batch(provider, batch[mid:], timeout, retries)}
+    except Exception as e:
+        logging.error(f"Grammar batch of {len(batch)} failed: {e}")
+        return {i: _error_result(e) for i, _ in batch}
+
+
+def analyze_sentences(texts: List[str], provider_name: str,
+                      concurrency: int = GRAMMAR_CONCURRENCY,
+                      timeout: float = GRAMMAR_TIMEOUT,
+                      retries: int = GRAMMAR_RETRIES,
+                      batch_tokens: int = GRAMMAR_BATCH_TOKENS,
+                      on_result: Callable[[int, Dict[str, Any]], None] | None = None
+                      ) -> List[Dict[str, Any]]:
+    """
+    Grammar-check every text with at most `concurrency` requests in flight,
+    batching sentences per request when `batch_tokens` > 0.
+    `on_result(i, result)` is called as soon as the result for texts[i] is
+    known (from any thread), e.g. to checkpoint or publish it.
+    Returns one result per text, in the same order as `texts`.
+    """
+    provider = get_provider(provider_name)
+    if not texts:
+        return []
+    cache_args = (provider_name.lower(), provider.MODEL, provider.PROMPT_VERSION)
+    results: List[Dict[str, Any] | None] = [None] * len(texts)
+
+    def deliver(i: int, result: Dict[str, Any]) -> None:
+        results[i] = result
+        if on_result is not None:
+            on_result(i, result)
+
+    misses: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        cached = grammar_cache.get(text, *cache_args) if grammar_cache.ENABLED else None
+        if cached is not None:
+            deliver(i, cached)
+        else:
+            misses.setdefault(grammar_cache.normalize_text(text), []).append(i)
+    if misses:
+        groups = list(misses.values())
+        unique = [texts[positions[0]] for positions in groups]
+
+        def fresh(j: int, result: Dict[str, Any]) -> None:
+            if grammar_cache.ENABLED:
+                grammar_cache.put(unique[j], *cache_args, result)
+            for i in groups[j]:
+                deliver(i, result)
+
+        _analyze_uncached(provider, unique, concurrency, timeout, retries, batch_tokens, fresh)
+    return results
+
+
+def _analyze_uncached(provider, texts: List[str], concurrency: int, timeout: float,
+                      retries: int, batch_tokens: int,
+                      on_result: Callable[[int, Dict[str, Any]], None]) -> None:
+    if batch_tokens > 0:
+        batches = make_batches(list(enumerate(texts)), batch_tokens)
+        task = lambda b: analyze_batch(provider, b, timeout, retries)
+    else:
+        batches = list(enumerate(texts))
+        task = lambda item: {item[0]: analyze_with_retry(provider, item[1], timeout, retries)}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches))),
+                            thread_name_prefix="grammar") as pool:
+        for future in as_completed([pool.submit(task, b) for b in batches]):
+            for i, result in future.result().items():
+                on_result(i, result)
@@ -1,16 +1,48 @@
 import json
+import os
+import threading
 from pathlib import Path
 import requests
 from google import genai
-from google.genai import types
-from typing import Dict, Any, List
+from google.genai import errors, types
+from typing import Dict, Any, List, Tuple
 from dotenv import load_dotenv
+import http_pool
+import grammar_check  # shared response parsing; grammar_check imports this module too
 
 load_dotenv()
 
 # Google Gemini API configuration
 # You'll need to set your Gemini API key as an environment variable: GEMINI_API_KEY
 # Get your free API key from: https://aistudio.google.com/app/apikey
+# GEMINI_BASE_URL optionally points the client at another endpoint (e.g. a local stub server)
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL") or None
+MODEL = "gemini-2.5-flash"  # Using the latest Gemini model
+PROMPT_VERSION = 1  # bump when the prompts change so cached results are invalidated
+
+_client: genai.Client | None = None
+_client_lock = threading.Lock()
+
+def get_client() -> genai.Client:
+    """
+    Shared Gemini client, created on first use. All grammar calls reuse its
+    keep-alive connection pool (see `http_pool`); the client is thread-safe.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # API key from environment variable GEMINI_API_KEY
+                _client = genai.Client(http_options=types.HttpOptions(
+                    base_url=GEMINI_BASE_URL,
+                    client_args=http_pool.client_args(),
+                ))
+    return _client
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True if `error` is Gemini telling us to slow down (HTTP 429)."""
+    return isinstance(error, errors.APIError) and error.code == 429
 
 def read_text_from_file(file_path: str) -> str:
     """
@@ -30,16 +62,17 @@ def read_text_from_file(file_path: str) -> str:
         return ""
 
 
-def check_grammar_with_ai(text: str) -> Dict[str, Any]:
+def check_grammar_with_ai(text: str, timeout: float | None = None) -> Dict[str, Any]:
     """
     Uses Google Gemini to analyze grammar and provide corrections.
     
     :param text: The text to analyze
+    :param timeout: Per-request timeout in seconds (None uses the client default)
     :return: Dictionary containing grammar analysis results
+    :raises: the provider's rate-limit error, so callers can back off and retry
     """
     try:
-        # Initialize Gemini client (API key from environment variable GEMINI_API_KEY)
-        client = genai.Client()
+        client = get_client()
         
         # Set up the prompt for grammar analysis
         prompt = f"""
@@ -60,11 +93,12 @@ def check_grammar_with_ai(text: str) -> Dict[str, Any]:
         
         # Make API call to Gemini
         response = client.models.generate_content(
-            model="gemini-2.5-flash",  # Using the latest Gemini model
+            model=MODEL,
             contents=prompt,
             config=types.GenerateContentConfig(
                 temperature=0.1,  # Low temperature for more consistent results
-                thinking_config=types.ThinkingConfig(thinking_budget=0)  # Disable thinking for speed
+                thinking_config=types.ThinkingConfig(thinking_budget=0),  # Disable thinking for speed
+                http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
             )
         )
         
@@ -74,15 +108,7 @@ def check_grammar_with_ai(text: str) -> Dict[str, Any]:
         # Try to parse the JSON response
         try:
             # Clean the response text to extract JSON
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.rfind("```")
-                response_text = response_text[json_start:json_end].strip()
-            
+            response_text = grammar_check.strip_code_fences(response_text)
             result = json.loads(response_text)
             return result
         except json.JSONDecodeError:
@@ -94,6 +120,8 @@ def check_grammar_with_ai(text: str) -> Dict[str, Any]:
             }
             
     except Exception as e:
+        if is_rate_limit_error(e):
+            raise
         return {
             "is_grammatically_correct": False,
             "corrected_text": "",
@@ -102,8 +130,55 @@ def check_grammar_with_ai(text: str) -> Dict[str, Any]:
 
 
 
+def check_grammar_batch_with_ai(items: List[Tuple[int, str]],
+                                timeout: float | None = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Uses Google Gemini to analyze several sentences in a single request.
+    
+    :param items: (sentence_id, text) pairs to analyze
+    :param timeout: Per-request timeout in seconds (None uses the client default)
+    :return: Dictionary mapping each sentence_id to its grammar analysis
+    :raises ValueError: if the response is not a JSON array covering every id
+    :raises: the provider's rate-limit error, so callers can back off and retry
+    """
+    client = get_client()
+    
+    sentences = "\n".join(json.dumps({"id": i, "text": t}, ensure_ascii=False) for i, t in items)
+    prompt = f"""
+        Analyze each of the following sentences for grammar issues and provide corrections.
+        Each sentence is given as a JSON object with an "id" and a "text":
+        
+        {sentences}
+        
+        Respond with a JSON array containing exactly one object per sentence, in this format:
+        [
+            {{
+                "id": <the sentence id>,
+                "is_grammatically_correct": true/false,
+                "corrected_text": "corrected version of the sentence",
+                "overall_feedback": "general feedback about the grammar and tell the user clearly where the grammar issues are"
+            }}
+        ]
+        
+        If a sentence is grammatically correct, set is_grammatically_correct to true and provide the original text as corrected_text.
+        Be specific about any grammar issues found. Analyze every sentence on its own.
+        """
+    
+    response = client.models.generate_content(
+        model=MODEL,
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            temperature=0.1,
+            response_mime_type="application/json",
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
+            http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
+        )
+    )
+    
+    return grammar_check.parse_batch_response(response.text or "", items)
+
 
-def analyze_grammar(text_content: str) -> Dict[str, Any]:
+def analyze_grammar(text_content: str, timeout: float | None = None) -> Dict[str, Any]:
     """
     High-level function: reads text from file, checks grammar with AI, and formats results.
     
@@ -118,7 +193,7 @@ def analyze_grammar(text_content: str) -> Dict[str, Any]:
         }
     
     # Check grammar with AI
-    grammar_analysis = check_grammar_with_ai(text_content)
+    grammar_analysis = check_grammar_with_ai(text_content, timeout=timeout)
     
     # Format issues
     return {
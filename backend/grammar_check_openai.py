@@ -1,15 +1,41 @@
 import json
+import threading
 from pathlib import Path
 import requests
-from openai import OpenAI
-from typing import Dict, Any, List
+from openai import NOT_GIVEN, DefaultHttpxClient, OpenAI, RateLimitError
+from typing import Dict, Any, List, Tuple
 from dotenv import load_dotenv
+import http_pool
+import grammar_check  # shared response parsing; grammar_check imports this module too
 
 load_dotenv()
 
 # OpenAI API configuration
 # You'll need to set your OpenAI API key as an environment variable: OPENAI_API_KEY
 # or set it directly: client = OpenAI(api_key="your-api-key-here")
+# OPENAI_BASE_URL optionally points the client at another endpoint (e.g. a local stub server)
+
+MODEL = "gpt-4"
+PROMPT_VERSION = 1  # bump when the prompts change so cached results are invalidated
+
+_client: OpenAI | None = None
+_client_lock = threading.Lock()
+
+def get_client() -> OpenAI:
+    """
+    Shared OpenAI client, created on first use. All grammar calls reuse its
+    keep-alive connection pool (see `http_pool`); the client is thread-safe.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(http_client=DefaultHttpxClient(**http_pool.client_args()))
+    return _client
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True if `error` is OpenAI telling us to slow down (HTTP 429)."""
+    return isinstance(error, RateLimitError)
 
 def read_text_from_file(file_path: str) -> str:
     """
@@ -29,16 +55,17 @@ def read_text_from_file(file_path: str) -> str:
         return ""
 
 
-def check_grammar_with_ai(text: str) -> Dict[str, Any]:
+def check_grammar_with_ai(text: str, timeout: float | None = None) -> Dict[str, Any]:
     """
     Uses OpenAI GPT to analyze grammar and provide corrections.
     
     :param text: The text to analyze
+    :param timeout: Per-request timeout in seconds (None uses the client default)
     :return: Dictionary containing grammar analysis results
+    :raises: the provider's rate-limit error, so callers can back off and retry
     """
     try:
-        # Initialize OpenAI client
-        client = OpenAI()
+        client = get_client()
         
         # Set up the prompt for grammar analysis
         prompt = f"""
@@ -58,13 +85,14 @@ def check_grammar_with_ai(text: str) -> Dict[str, Any]:
         
         # Make API call to OpenAI
         response = client.chat.completions.create(
-            model="gpt-4",  # You can also use "gpt-4" for better results
+            model=MODEL,
             messages=[
                 {"role": "system", "content": "You are a professional English grammar expert. Provide accurate grammar analysis and corrections in the specified JSON format."},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.1,  # Low temperature for more consistent results
-            max_tokens=1000
+            max_tokens=1000,
+            timeout=timeout if timeout is not None else NOT_GIVEN,
         )
         
         # Extract the response content
@@ -83,6 +111,8 @@ def check_grammar_with_ai(text: str) -> Dict[str, Any]:
             }
             
     except Exception as e:
+        if is_rate_limit_error(e):
+            raise
         return {
             "is_grammatically_correct": False,
             "corrected_text": "",
@@ -91,8 +121,52 @@ def check_grammar_with_ai(text: str) -> Dict[str, Any]:
 
 
 
+def check_grammar_batch_with_ai(items: List[Tuple[int, str]],
+                                timeout: float | None = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Uses OpenAI GPT to analyze several sentences in a single request.
+    
+    :param items: (sentence_id, text) pairs to analyze
+    :param timeout: Per-request timeout in seconds (None uses the client default)
+    :return: Dictionary mapping each sentence_id to its grammar analysis
+    :raises ValueError: if the response is not a JSON array covering every id
+    :raises: the provider's rate-limit error, so callers can back off and retry
+    """
+    client = get_client()
+    
+    sentences = "\n".join(json.dumps({"id": i, "text": t}, ensure_ascii=False) for i, t in items)
+    prompt = f"""
+        Analyze each of the following sentences for grammar issues and provide corrections.
+        Each sentence is given as a JSON object with an "id" and a "text":
+        
+        {sentences}
+        
+        Respond only with a JSON array containing exactly one object per sentence, in this format:
+        [
+            {{
+                "id": <the sentence id>,
+                "is_grammatically_correct": true/false,
+                "corrected_text": "corrected version of the sentence",
+                "overall_feedback": "general feedback about the grammar and tell the user clearly if where is the grammar issues"
+            }}
+        ]
+        """
+    
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": "You are a professional English grammar expert. Provide accurate grammar analysis and corrections in the specified JSON format."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.1,
+        max_tokens=min(4000, 300 * len(items)),
+        timeout=timeout if timeout is not None else NOT_GIVEN,
+    )
+    
+    return grammar_check.parse_batch_response(response.choices[0].message.content or "", items)
+
 
-def analyze_grammar(text_content: str) -> Dict[str, Any]:
+def analyze_grammar(text_content: str, timeout: float | None = None) -> Dict[str, Any]:
     """
     High-level function: reads text from file, checks grammar with AI, and formats results.
     
@@ -107,7 +181,7 @@ def analyze_grammar(text_content: str) -> Dict[str, Any]:
         }
     
     # Check grammar with AI
-    grammar_analysis = check_grammar_with_ai(text_content)
+    grammar_analysis = check_grammar_with_ai(text_content, timeout=timeout)
     
     # Format issues
     return {
@@ -0,0 +1,60 @@
+"""
+Shared HTTP connection pooling for the grammar providers.
+
+Both provider SDKs are httpx based; `client_args()` returns the httpx.Client
+keyword arguments that give them a keep-alive pool of HTTP_POOL_SIZE
+connections and hook every request into the connection-reuse metric.
+
+The metric uses httpcore's "trace" request extension: a request that had to
+open a TCP connection reports `connection.connect_tcp.complete`, anything
+else reused a pooled connection.
+"""
+import os
+import threading
+from typing import Any, Dict
+
+import httpx
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+_lock = threading.Lock()
+_counters = {"requests": 0, "new_connections": 0}
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _counters[name] += 1
+
+
+def _trace(event_name: str, info: Dict[str, Any]) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        _count("new_connections")
+
+
+def _on_request(request: httpx.Request) -> None:
+    _count("requests")
+    request.extensions["trace"] = _trace
+
+
+def client_args(pool_size: int = POOL_SIZE) -> Dict[str, Any]:
+    """Keyword arguments for an httpx.Client with a shared keep-alive pool."""
+    return {
+        "limits": httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        "event_hooks": {"request": [_on_request]},
+    }
+
+
+def stats() -> Dict[str, Any]:
+    """Requests sent, connections opened and the share of requests that reused one."""
+    with _lock:
+        requests, new = _counters["requests"], _counters["new_connections"]
+        return {
+            "requests": requests,
+            "new_connections": new,
+            "reuse_rate": round(1 - new / requests, 3) if requests else None,
+        }
@@ -0,0 +1,244 @@
+"""
+Staged job scheduler for conversation processing.
+
+The pipeline is a dependency graph of stages (split, then tts, score and
+grammar side by side, see `process.PIPELINE_STAGES`). Every stage has its own
+queue and its own worker threads, so while conversation A is being scored, B
+can be transcribed and C can wait on the grammar API. A stage starts for a
+conversation as soon as all the stages it depends on have finished, so stages
+that only share a dependency run concurrently for the same conversation.
+
+The number of workers of a stage comes from <STAGE>_WORKERS (e.g.
+SPLIT_WORKERS, TTS_WORKERS, SCORE_WORKERS, GRAMMAR_WORKERS; default 1). At most
+PIPELINE_QUEUE_SIZE conversations may wait for the first stage; when that
+queue is full, `submit` raises `QueueFull` and the upload endpoint answers 429.
+When a job is submitted and whenever the first queue moves,
+`on_position(job_id, position)` is called for the waiting jobs (1 = next to
+run), so clients can show their place in line. It is called with the
+scheduler's lock held, so a job's position is always reported before a worker
+can start it; the callback must not call back into the scheduler.
+
+`stats()` reports per-stage load and end-to-end throughput in conversations
+per hour.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+THROUGHPUT_WINDOW = 3600.0  # seconds of completions used for conversations/hour
+
+
+def stage_workers(name: str, default: int = 1) -> int:
+    """Configured worker count for a stage, from <NAME>_WORKERS."""
+    return max(1, int(os.getenv(f"{name.upper()}_WORKERS", str(default))))
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Stage:
+    def __init__(self, name: str, run: Callable[[str], bool], workers: int = 1,
+                 deps: Iterable[str] = ()):
+        self.name = name
+        self.run = run
+        self.workers = max(1, workers)
+        self.deps = set(deps)
+        self.queue: deque[str] = deque()
+        self.running: set[str] = set()
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+
+class JobScheduler:
+    def __init__(self, stages: list[Stage], max_queued: int = PIPELINE_QUEUE_SIZE,
+                 on_position: Callable[[str, int], None] | None = None,
+                 on_complete: Callable[[str], None] | None = None,
+                 on_failed: Callable[[str, str], None] | None = None):
+        names = {s.name for s in stages}
+        for s in stages:
+            if not s.deps <= names:
+                raise ValueError(f"Stage {s.name} depends on unknown stages {s.deps - names}")
+        self.stages = {s.name: s for s in stages}
+        self.roots = [s for s in stages if not s.deps]
+        if not self.roots:
+            raise ValueError("At least one stage must have no dependencies")
+        self.max_queued = max_queued
+        self.on_position = on_position
+        self.on_complete = on_complete
+        self.on_failed = on_failed
+        self._done: dict[str, set[str]] = {}        # job -> finished stages
+        self._started: dict[str, set[str]] = {}     # job -> queued/running/finished stages
+        self._submitted_at: dict[str, float] = {}
+        self._completed_at: deque[float] = deque()
+        self._latencies: deque[float] = deque(maxlen=100)
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._started_at = time.monotonic()
+        self._counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._started_at = time.monotonic()
+            for stage in self.stages.values():
+                for n in range(stage.workers):
+                    t = threading.Thread(target=self._work, args=(stage,),
+                                         name=f"{stage.name}-{n}", daemon=True)
+                    t.start()
+                    self._threads.append(t)
+
+    def _waiting(self) -> int:
+        return max(len(s.queue) for s in self.roots)
+
+    def is_full(self) -> bool:
+        with self._cond:
+            return self._waiting() >= self.max_queued
+
+    def submit(self, job_id: str, force: bool = False) -> int:
+        """
+        Queue `job_id` for its first stage(s). Returns its 1-based queue
+        position, or raises QueueFull (unless `force`, used to resume jobs).
+        """
+        self.start()
+        with self._cond:
+            if job_id in self._done:
+                return self._position(job_id)
+            if not force and self._waiting() >= self.max_queued:
+                self._counters["rejected"] += 1
+                raise QueueFull(f"Job queue is full ({self.max_queued} waiting)")
+            self._counters["submitted"] += 1
+            self._done[job_id] = set()
+            self._started[job_id] = set()
+            self._submitted_at[job_id] = time.monotonic()
+            self._schedule(job_id)
+            position = max(len(s.queue) for s in self.roots)
+            self._notify_positions([(job_id, position)])
+            return position
+
+    def _schedule(self, job_id: str) -> None:
+        """Queue every stage whose dependencies are done. Caller holds the lock."""
+        done, started = self._done[job_id], self._started[job_id]
+        for stage in self.stages.values():
+            if stage.name not in started and stage.deps <= done:
+                started.add(stage.name)
+                stage.queue.append(job_id)
+        self._cond.notify_all()
+
+    def position(self, job_id: str) -> int | None:
+        """1-based position in the first stage's queue, 0 if past it, None if unknown."""
+        with self._cond:
+            return self._position(job_id)
+
+    def _position(self, job_id: str) -> int | None:
+        if job_id not in self._done:
+            return None
+        for stage in self.roots:
+            if job_id in stage.queue:
+                return stage.queue.index(job_id) + 1
+        return 0
+
+    def _notify_positions(self, positions: Iterable[tuple[str, int]]) -> None:
+        """Report queue positions. Caller holds the lock."""
+        if self.on_position is None:
+            return
+        for job_id, pos in positions:
+            try:
+                self.on_position(job_id, pos)
+            except Exception as e:
+                logging.error(f"Queue position callback failed for {job_id}: {e}")
+
+    def _callback(self, fn, *args) -> None:
+        if fn is None:
+            return
+        try:
+            fn(*args)
+        except Exception as e:
+            logging.error(f"Scheduler callback failed for {args[0]}: {e}")
+
+    def _work(self, stage: Stage) -> None:
+        while True:
+            with self._cond:
+                while not stage.queue:
+                    self._cond.wait()
+                job_id = stage.queue.popleft()
+                stage.running.add(job_id)
+                if not stage.deps:
+                    self._notify_positions((j, pos) for pos, j in enumerate(stage.queue, start=1))
+            t0 = time.perf_counter()
+            try:
+                ok = bool(stage.run(job_id))
+            except Exception as e:
+                logging.error(f"Stage {stage.name} failed for {job_id}: {e}")
+                ok = False
+            elapsed = time.perf_counter() - t0
+            finished = failed = False
+            with self._cond:
+                stage.running.discard(job_id)
+                stage.processed += 1
+                stage.busy_seconds += elapsed
+                if job_id not in self._done:
+                    continue  # job already failed in another stage
+                if not ok:
+                    failed = True
+                    self._forget(job_id)
+                    self._counters["failed"] += 1
+                else:
+                    self._done[job_id].add(stage.name)
+                    if len(self._done[job_id]) == len(self.stages):
+                        finished = True
+                    else:
+                        self._schedule(job_id)
+            if failed:
+                self._callback(self.on_failed, job_id, stage.name)
+            elif finished:
+                self._callback(self.on_complete, job_id)
+                with self._cond:
+                    now = time.monotonic()
+                    self._latencies.append(now - self._submitted_at[job_id])
+                    self._completed_at.append(now)
+                    self._counters["completed"] += 1
+                    self._forget(job_id)
+                logging.info(f"Job {job_id} completed")
+
+    def _forget(self, job_id: str) -> None:
+        self._done.pop(job_id, None)
+        self._started.pop(job_id, None)
+        self._submitted_at.pop(job_id, None)
+        for stage in self.stages.values():
+            if job_id in stage.queue:
+                stage.queue.remove(job_id)
+
+    def throughput_per_hour(self) -> float:
+        """Conversations completed per hour over the last hour (or uptime, if shorter)."""
+        now = time.monotonic()
+        while self._completed_at and now - self._completed_at[0] > THROUGHPUT_WINDOW:
+            self._completed_at.popleft()
+        window = min(THROUGHPUT_WINDOW, max(60.0, now - self._started_at))
+        return len(self._completed_at) * 3600.0 / window
+
+    def stats(self) -> dict:
+        with self._cond:
+            latencies = list(self._latencies)
+            return dict(
+                self._counters,
+                max_queued=self.max_queued,
+                in_flight=len(self._done),
+                conversations_per_hour=round(self.throughput_per_hour(), 1),
+                mean_latency_seconds=round(sum(latencies) / len(latencies), 1) if latencies else None,
+                stages={
+                    s.name: {
+                        "workers": s.workers,
+                        "queued": len(s.queue),
+                        "running": len(s.running),
+                        "processed": s.processed,
+                        "mean_seconds": round(s.busy_seconds / s.processed, 2) if s.processed else None,
+                    }
+                    for s in self.stages.values()
+                },
+            )
@@ -0,0 +1,212 @@
+"""
+Process-wide registry for the heavy models used by the pipeline
+(WavLM, Whisper, Coqui TTS).
+
+Each model is loaded lazily on first use and then kept warm for the life of
+the worker, so sentences and conversations no longer pay the load cost again.
+
+    model_registry.register("wavlm:large", load_fn)              # shared
+    model_registry.register("whisper:base.en", load_fn, thread_safe=False)
+
+    with model_registry.use("wavlm:large") as wavlm:          # shared
+        wavlm.extract_features(...)
+    with model_registry.use("whisper:base.en") as model:      # serialized
+        model.transcribe(...)
+
+Models that are not safe to call from several threads at once (Whisper
+installs forward hooks per call, Coqui keeps synthesis state) are registered
+with `thread_safe=False`; `use()` then holds a per-model lock while the
+caller runs inference.
+
+Only models held through `use()` count as in use and are safe from idle
+eviction; `get()` hands out the model without that protection, so with
+MODEL_IDLE_TTL set, callers holding a model across inference should use `use()`.
+
+Set MODEL_IDLE_TTL (seconds) to evict models that have not been used for
+that long; 0 (the default) keeps everything loaded.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+IDLE_TTL = float(os.getenv("MODEL_IDLE_TTL", "0"))  # 0 disables idle eviction
+
+
+class _Entry:
+    def __init__(self, loader: Callable[[], Any], thread_safe: bool):
+        self.loader = loader
+        self.thread_safe = thread_safe
+        self.model: Any = None
+        self.load_lock = threading.Lock()   # guards loading / eviction and in_use
+        self.use_lock = threading.RLock()   # serializes inference if not thread safe
+        self.loads = 0
+        self.hits = 0
+        self.load_seconds = 0.0
+        self.param_bytes = 0
+        self.rss_delta_bytes = 0
+        self.last_used = 0.0
+        self.in_use = 0
+
+
+_entries: dict[str, _Entry] = {}
+_registry_lock = threading.Lock()
+_evictor: threading.Thread | None = None
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process (Linux only, 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _param_bytes(model: Any) -> int:
+    """Bytes held by parameters and buffers of a torch module (0 otherwise)."""
+    if not hasattr(model, "parameters") or not hasattr(model, "buffers"):
+        return 0
+    try:
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    except Exception:
+        return 0
+
+
+def register(name: str, loader: Callable[[], Any], thread_safe: bool = True) -> str:
+    """
+    Register a model loader under `name`. Registering an existing name is a
+    no-op, so modules can register their models at import time.
+    """
+    with _registry_lock:
+        if name not in _entries:
+            _entries[name] = _Entry(loader, thread_safe)
+    return name
+
+
+def _entry(name: str) -> _Entry:
+    try:
+        return _entries[name]
+    except KeyError:
+        raise KeyError(f"Model '{name}' is not registered") from None
+
+
+def _load(name: str, entry: _Entry, acquire: bool = False) -> Any:
+    """Load the model if needed; with `acquire`, count it in use before releasing the lock."""
+    with entry.load_lock:
+        if entry.model is None:
+            rss_before = _rss_bytes()
+            t0 = time.perf_counter()
+            entry.model = entry.loader()
+            entry.load_seconds = time.perf_counter() - t0
+            entry.rss_delta_bytes = max(0, _rss_bytes() - rss_before)
+            entry.param_bytes = _param_bytes(entry.model)
+            entry.loads += 1
+            logging.info(f"Loaded model {name} in {entry.load_seconds:.1f}s")
+        else:
+            entry.hits += 1
+        entry.last_used = time.monotonic()
+        if acquire:
+            entry.in_use += 1
+        return entry.model
+
+
+def get(name: str) -> Any:
+    """
+    Return the warm model registered under `name`, loading it if needed.
+    Only use this directly for thread-safe models; otherwise use `use()`.
+    The model is not counted as in use, so the idle evictor may drop it while
+    the caller still holds it (the next call then loads a fresh copy).
+    """
+    return _load(name, _entry(name))
+
+
+@contextmanager
+def use(name: str) -> Iterator[Any]:
+    """
+    Context manager yielding the model. Non thread-safe models are locked for
+    the duration of the block; a model in use is never evicted.
+    """
+    entry = _entry(name)
+    # counted in use under load_lock, so eviction cannot slip in between
+    model = _load(name, entry, acquire=True)
+    try:
+        if entry.thread_safe:
+            yield model
+        else:
+            with entry.use_lock:
+                yield model
+    finally:
+        with entry.load_lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+
+def evict(name: str, idle_for: float | None = None) -> bool:
+    """
+    Drop a loaded model unless it is in use (or, with `idle_for`, was used in
+    the last `idle_for` seconds). Returns True if something was evicted.
+    """
+    entry = _entries.get(name)
+    if entry is None:
+        return False
+    with entry.load_lock:
+        if entry.model is None or entry.in_use:
+            return False
+        if idle_for is not None and time.monotonic() - entry.last_used <= idle_for:
+            return False
+        entry.model = None
+    gc.collect()
+    logging.info(f"Evicted model {name}")
+    return True
+
+
+def evict_idle(ttl: float = IDLE_TTL) -> list[str]:
+    """Evict every model that has been idle for more than `ttl` seconds."""
+    if ttl <= 0:
+        return []
+    now = time.monotonic()
+    idle = [
+        name for name, e in list(_entries.items())
+        if e.model is not None and not e.in_use and now - e.last_used > ttl
+    ]
+    # evict() re-checks under the model's lock; it may have been picked up since
+    return [name for name in idle if evict(name, idle_for=ttl)]
+
+
+def start_idle_evictor(ttl: float = IDLE_TTL, interval: float | None = None) -> None:
+    """Start a daemon thread that periodically evicts idle models."""
+    global _evictor
+    if ttl <= 0 or _evictor is not None:
+        return
+    interval = interval or max(1.0, ttl / 4)
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            evict_idle(ttl)
+
+    _evictor = threading.Thread(target=loop, name="model-evictor", daemon=True)
+    _evictor.start()
+
+
+def stats() -> dict[str, dict]:
+    """Load-time, memory and usage counters for every registered model."""
+    now = time.monotonic()
+    return {
+        name: {
+            "loaded": e.model is not None,
+            "thread_safe": e.thread_safe,
+            "loads": e.loads,
+            "hits": e.hits,
+            "load_seconds": round(e.load_seconds, 3),
+            "param_bytes": e.param_bytes,
+            "rss_delta_bytes": e.rss_delta_bytes,
+            "idle_seconds": round(now - e.last_used, 1) if e.last_used else None,
+        }
+        for name, e in list(_entries.items())
+    }
@@ -1,10 +1,15 @@
-import json
 import re
 import os
+import threading
 from pathlib import Path
 import logging
-import align_text, accent_check, grammar_check_gemini, grammar_check_openai
+from concurrent.futures import ThreadPoolExecutor
+import align_text, accent_check, grammar_check
+import tts_cache
 import util
+from result_store import ResultStore
+import catalog
+import worker_pool
 import subprocess
 import socketio
 
@@ -20,49 +25,106 @@ logging.basicConfig(
 # Configuration via environment variables
 TTS_ENGINE = os.getenv("TTS_ENGINE", "gtts")  # Default TTS engine
 VISUALIZE = os.getenv("VISUALIZE", "False").lower() == "true"  # Default visualization setting
+WAVLM_BATCHED = os.getenv("WAVLM_BATCHED", "True").lower() == "true"  # Batch word clips per WavLM forward
+SCORING_ENGINE = os.getenv("SCORING_ENGINE", "word").lower()  # "word" (re-encode slices) or "frame" (single pass)
+WRITE_SENTENCE_AUDIO = os.getenv("WRITE_SENTENCE_AUDIO", "False").lower() == "true"  # Eagerly write sentence_<i>.wav
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "4"))  # Native references rendered at once by the tts stage
 
 # In your pipeline or after status changes:
-def notify_status(socketio, conv_id, status):
-    socketio.emit('status', {'id': conv_id, 'status': status})
+def notify_status(socketio, conv_id, status, **extra):
+    socketio.emit('status', {'id': conv_id, 'status': status, **extra})
+
+def notify_sentence(socketio, conv_id, payload):
+    """
+    Emit one sentence's latest results as soon as they exist. Scoring and grammar
+    run concurrently and each publishes the fields it produced, so clients merge
+    payloads by sentence_id.
+    """
+    socketio.emit('sentence', {'id': conv_id, **payload})
+
+def sentence_payload(sentence: dict, fields: tuple[str, ...]) -> dict:
+    """The published update of a sentence: only the `fields` its stage produced."""
+    return {"sentence_id": sentence.get("id"),
+            "sentence": {k: sentence[k] for k in fields if k in sentence}}
+
+def notify_stage(socketio, conv_id, stage):
+    """Record `stage` as running and emit the conversation's combined action."""
+    try:
+        meta = ResultStore.for_conversation(conv_id).start_stage(stage)
+    except Exception as e:
+        logging.error(f"Could not record stage {stage} of conversation {conv_id}: {e}")
+        return
+    if socketio:
+        notify_status(socketio, conv_id, meta.get("action"), stage=stage)
+
+# --- Checkpoints ---
+# The result store (see `result_store`) records finished stages under "stages"; within
+# the scoring and grammar stages a sentence that already has "word_scores" /
+# "grammar_analysis" is done. Every stage skips finished work, so an interrupted
+# conversation can be resubmitted.
+
+def interrupted_conversations(root: Path = Path("data")) -> list[str]:
+    """
+    Conversations whose pipeline never finished (e.g. the server died mid-stage),
+    oldest first, so they can be resumed on startup. Looked up in the `catalog`,
+    so startup does not scan every conversation folder.
+    """
+    if not root.exists():
+        return []
+    return [cid for cid in catalog.unsettled(root)
+            if (root / cid / f"conversation_{cid}.wav").exists()]
 
 def split_conversation_to_sentences(conversation_id: str) -> bool:
     """
-    Split the conversation audio into sentences and create an index.json file.
+    Split the conversation audio into sentences and store them in the result store.
 
     This function processes the audio file associated with the given conversation_id,
     extracts sentence boundaries using forced alignment, and stores sentence metadata
-    (including timing information) in an index.json file for downstream processing.
+    (including timing information) in the conversation's result store for downstream
+    processing.
+    Does nothing if the split stage already completed.
 
     Returns:
         True if successful, False otherwise.
     """
     conversation_path = Path("data") / conversation_id / f"conversation_{conversation_id}.wav"
     try:
-        index_path = Path("data") / conversation_id / "index.json"
-        with open(index_path, "r") as f:
-            index_data = json.load(f)
-        index_data["action"] = "splitting"
-        util.save_info_to_file(str(index_path), index_data)
+        store = ResultStore.for_conversation(conversation_id)
+        if store.stage_done("split") and store.sentences():
+            logging.info(f"Conversation {conversation_id} already split, skipping")
+            return True
+        store.start_stage("split")
         audio_info = align_text.load_wav_info(str(conversation_path))
         logging.info(f"Audio length: {audio_info[0]:.1f}s")
         tl = align_text.make_timeline(str(conversation_path))
-        util.add_info_to_index(str(index_path), {"sentences": tl})
+        store.set_sentences(tl)
+        store.mark_stage("split")
         return True
     except Exception as e:
         logging.error(f"Error splitting conversation: {e}")
         return False
 
-def score_accent(conversation_id: str, sr: int = 16000) -> bool:
+def score_accent(conversation_id: str, sr: int = 16000, publish=None) -> bool:
     """
     Score the user's audio for accent accuracy on a sentence-by-sentence basis.
 
     This function processes each sentence audio segment extracted from the user's conversation,
     compares it against a native reference (auto-generated if not provided), and computes
     both word-level and sentence-level accent scores using the configured TTS engine.
+    Word timings stored by `split_conversation_to_sentences` are reused, so sentences are
+    not transcribed a second time. The conversation is decoded once and each sentence is
+    a slice of it; sentence WAVs are only written when WRITE_SENTENCE_AUDIO is set
+    (otherwise the /sentence-audio route cuts them on demand). The slices are highpassed
+    and normalized in padded batches (`accent_check.preprocess_clips`) as the loop
+    reaches them.
+    Each sentence's scores are appended to the result store as soon as they exist and
+    sentences that already have scores are skipped, so an interrupted run resumes
+    where it stopped.
 
     Args:
         conversation_id (str): Unique identifier for the conversation.
         sr (int, optional): Sample rate for audio processing. Defaults to 16000.
+        publish (callable, optional): Called with each sentence's results as soon as it is scored.
 
     Returns:
         bool: True if scoring is successful for all sentences, False otherwise.
@@ -70,115 +132,277 @@ def score_accent(conversation_id: str, sr: int = 16000) -> bool:
     Logs detailed information and errors for each step, including per-sentence scoring results.
     """
     user_audio_path = Path("data") / conversation_id / f"conversation_{conversation_id}.wav"
-    index_path = Path("data") / conversation_id / "index.json"
     try:
-        with open(index_path, "r") as f:
-            index_data = json.load(f)
-        index_data["action"] = "scoring"
-        util.save_info_to_file(str(index_path), index_data)
-        sentences = index_data.get("sentences", [])
+        store = ResultStore.for_conversation(conversation_id)
+        if store.stage_done("score"):
+            logging.info(f"Conversation {conversation_id} already scored, skipping")
+            return True
+        store.start_stage("score")
+        sentences = store.sentences()
         if not sentences:
-            logging.error("No sentences found in index.json")
+            logging.error(f"No sentences found for conversation {conversation_id}")
             return False
-        sentence_audios = []
+        # decode the conversation once; sentences are sample-index views into it
+        conv_wav = accent_check.load_audio(str(user_audio_path), sr)
+        sentences_dir = Path("data") / conversation_id / "sentences"
+        sentences_dir.mkdir(parents=True, exist_ok=True)
+        pending = [i for i, s in enumerate(sentences)
+                   if "word_scores" not in s and "words" in s and s.get("audio_timeline")]
+        user_clips: dict = {}
+
+        def user_clip(i: int):
+            """Preprocessed slice of sentence i; filters the next batch of slices on a miss."""
+            if i not in user_clips:
+                user_clips.clear()
+                batch = pending[pending.index(i): pending.index(i) + accent_check.PREPROCESS_BATCH_SIZE]
+                slices = [conv_wav[:, int(sentences[j]["audio_timeline"]["start"] * sr):
+                                      int(sentences[j]["audio_timeline"]["end"] * sr)] for j in batch]
+                user_clips.update(zip(batch, accent_check.preprocess_clips(slices, sr)))
+            return user_clips[i]
+
         for i, sentence in enumerate(sentences):
+            index = sentence.get("id", i + 1)
+            if "word_scores" in sentence:
+                continue  # scored before an interruption
             audio_timeline = sentence.get("audio_timeline", None)
             if not audio_timeline:
                 logging.error(f"No audio timeline found for sentence {i+1}")
                 return False
             start, end = audio_timeline["start"], audio_timeline["end"]
-            sentence_audio_path = Path("data") / conversation_id / "sentences" / f"sentence_{i}.wav"
-            util.cut_audio(str(user_audio_path), str(sentence_audio_path), start, end)
-            sentence_audios.append((i+1, str(sentence_audio_path)))
-        for sentence_audio in sentence_audios:
-            index, user_audio_path = sentence_audio
-            logging.info(f"Scoring sentence {index} with audio {user_audio_path}")
-            # Find the sentence in sentences where s["id"] == index
-            native_txt = ""
-            for s in sentences:
-                if s.get("id") == index:
-                    native_txt = s.get("sentence_text", "")
-                    break
-            word_scores, sentence_score = accent_check.score_sentence(
-                user_audio_path=user_audio_path,
-                native_audio_path=None,
-                native_txt=native_txt,
-                sr=sr,
-                tts_engine=TTS_ENGINE,
-                visualize=VISUALIZE,
-            )
+            sentence_audio_path = sentences_dir / f"sentence_{i}.wav"
+            native_audio_path = sentences_dir / f"sentence_{i}_native.wav"
+            native_txt = sentence.get("sentence_text", "")
+            logging.info(f"Scoring sentence {index} ({start:.2f}s - {end:.2f}s)")
+            if WRITE_SENTENCE_AUDIO or "words" not in sentence:
+                util.write_audio_segment(str(user_audio_path), str(sentence_audio_path), start, end)
+            if "words" not in sentence:
+                # index.json from before word timings were stored: re-transcribe
+                word_scores, sentence_score = accent_check.score_sentence(
+                    user_audio_path=str(sentence_audio_path),
+                    native_audio_path=None,
+                    native_txt=native_txt,
+                    sr=sr,
+                    tts_engine=TTS_ENGINE,
+                    visualize=VISUALIZE,
+                    batched=WAVLM_BATCHED,
+                    engine=SCORING_ENGINE,
+                )
+            else:
+                # reuse first-pass timings, shifted to the sentence clip
+                words = [
+                    {"word": w["word"], "start": max(0.0, w["start"] - start), "end": max(0.0, w["end"] - start)}
+                    for w in sentence["words"]
+                ]
+                word_scores, sentence_score = accent_check.score_sentence_words(
+                    user_audio=user_clip(i),
+                    preprocessed=True,
+                    words=words,
+                    native_audio_path=None,
+                    native_out_path=str(native_audio_path),
+                    native_txt=native_txt,
+                    sr=sr,
+                    tts_engine=TTS_ENGINE,
+                    visualize=VISUALIZE,
+                    batched=WAVLM_BATCHED,
+                    engine=SCORING_ENGINE,
+                )
             logging.info(f"Word Scores: {word_scores}")
             logging.info(f"Sentence Score: {sentence_score}")
-            for s in index_data["sentences"]:
-                if s.get("id") == index:
-                    s["word_scores"] = word_scores
-                    s["sentence_score"] = sentence_score
-                    index_data["sentences"].remove(s)
-                    index_data["sentences"].append(s)
-                    break
-        util.save_info_to_file(str(index_path), index_data)
+            sentence["word_scores"] = word_scores
+            sentence["sentence_score"] = sentence_score
+            store.update_sentence(index, word_scores=word_scores, sentence_score=sentence_score)  # checkpoint
+            if publish:
+                publish(sentence_payload(sentence, ("word_scores", "sentence_score")))
+        store.mark_stage("score")
         return True
     except Exception as e:
         logging.error(f"Error scoring accent: {e}")
         return False
 
-def grammar_check_with_ai(conversation_id: str) -> bool:
+def synthesize_native_references(conversation_id: str) -> bool:
+    """
+    Render the native TTS reference of every sentence into `tts_cache` ahead of scoring.
+
+    Runs as soon as the split is done, alongside scoring and grammar checking. Scoring
+    asks the cache for the same references; the cache renders each key once and
+    concurrent callers wait for that rendering, so a sentence is never synthesized
+    twice and scoring only waits on references the prefetch has not reached yet.
+    Does nothing when the TTS cache is disabled (scoring then synthesizes itself).
+
+    Returns:
+        bool: True unless the sentences cannot be read; a failed rendering is only
+        logged, scoring retries it.
+    """
+    if not tts_cache.ENABLED:
+        return True
+    try:
+        store = ResultStore.for_conversation(conversation_id)
+        if store.stage_done("tts"):
+            return True
+        texts = [s.get("sentence_text", "") for s in store.sentences()]
+    except Exception as e:
+        logging.error(f"Error reading sentences for TTS: {e}")
+        return False
+
+    def render(text: str) -> None:
+        try:
+            tts_cache.native_wav(text, TTS_ENGINE)
+        except Exception as e:
+            logging.error(f"Native reference rendering failed for '{text}': {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, TTS_CONCURRENCY)) as pool:
+        list(pool.map(render, [t for t in texts if t]))
+    store.mark_stage("tts")
+    return True
+
+def grammar_check_with_ai(conversation_id: str, publish=None) -> bool:
     """
     Perform AI-powered grammar analysis for each sentence in the conversation.
 
-    This function loads sentence data from index.json, analyzes grammar using an AI model,
-    and updates each sentence entry with grammar feedback. Results are saved back to index.json.
+    This function loads sentence data from the result store, analyzes grammar using an AI
+    model, and updates each sentence entry with grammar feedback. Sentences are checked
+    concurrently (see `grammar_check` for the concurrency, timeout and retry settings).
+    Each result is appended to the result store as it arrives and sentences that already
+    have a grammar analysis are skipped, so an interrupted run resumes where it stopped.
+    `publish`, if given, is called with each sentence's results as soon as they arrive.
 
     Returns:
         bool: True if grammar analysis is successful for all sentences, False otherwise.
 
     Logs detailed information and errors for each step, including per-sentence grammar results.
     """
-    index_path = Path("data") / conversation_id / "index.json"
     try:
-        with open(index_path, "r") as f:
-            index_data = json.load(f)
-        index_data["action"] = "checking grammar"
-        util.save_info_to_file(str(index_path), index_data)
-        sentences = index_data.get("sentences", [])
+        store = ResultStore.for_conversation(conversation_id)
+        if store.stage_done("grammar"):
+            logging.info(f"Conversation {conversation_id} already grammar-checked, skipping")
+            return True
+        store.start_stage("grammar")
+        sentences = store.sentences()
         if not sentences:
-            logging.error("No sentences found in index.json")
+            logging.error(f"No sentences found for conversation {conversation_id}")
             return False
+        pending = []
         for sentence in sentences:
             index = sentence.get("id")
             if index is None:
                 logging.error(f"Sentence {sentence} does not have a valid 'id' field")
                 return False
             text_content = sentence.get("sentence_text", "")
-            if not text_content:
+            if not text_content or "grammar_analysis" in sentence:
                 continue
-            if GRAMMAR_CHECK_AI == "gemini":
-                grammar_analysis = grammar_check_gemini.analyze_grammar(text_content)
-            elif GRAMMAR_CHECK_AI == "openai":
-                grammar_analysis = grammar_check_openai.analyze_grammar(text_content)
-            else:
-                logging.error(f"Unsupported grammar check AI: {GRAMMAR_CHECK_AI}")
-                return False
-            logging.info(f"Grammar Analysis for Sentence {index}: {grammar_analysis}")
-            for s in index_data["sentences"]:
-                if s.get("id") == index:
-                    s["grammar_analysis"] = grammar_analysis
-                    break
-        util.save_info_to_file(str(index_path), index_data)
+            pending.append(sentence)
+        publish_lock = threading.Lock()
+
+        def checkpoint(i: int, grammar_analysis: dict) -> None:
+            sentence = pending[i]
+            logging.info(f"Grammar Analysis for Sentence {sentence['id']}: {grammar_analysis}")
+            sentence["grammar_analysis"] = grammar_analysis
+            store.update_sentence(sentence["id"], grammar_analysis=grammar_analysis)
+            if publish:
+                with publish_lock:
+                    publish(sentence_payload(sentence, ("grammar_analysis",)))
+
+        grammar_check.analyze_sentences(
+            [s["sentence_text"] for s in pending], GRAMMAR_CHECK_AI, on_result=checkpoint,
+        )
+        store.mark_stage("grammar")
         return True
     except Exception as e:
         logging.error(f"Error in grammar check: {e}")
         return False
 
+def run_split_stage(conversation_id: str, socketio=None) -> bool:
+    notify_stage(socketio, conversation_id, "split")
+    if not worker_pool.run_stage(split_conversation_to_sentences, conversation_id):
+        logging.error(f"Failed to process conversation {conversation_id}")
+        return False
+    return True
+
+def run_tts_stage(conversation_id: str, socketio=None) -> bool:
+    logging.info(f"Rendering native references for conversation {conversation_id}")
+    if not synthesize_native_references(conversation_id):
+        logging.error(f"Failed to render native references for conversation {conversation_id}")
+        return False
+    return True
+
+def run_score_stage(conversation_id: str, socketio=None) -> bool:
+    notify_stage(socketio, conversation_id, "score")
+    logging.info(f"Scoring accent for conversation {conversation_id}")
+    on_event = (lambda payload: notify_sentence(socketio, conversation_id, payload)) if socketio else None
+    if not worker_pool.run_stage(score_accent, conversation_id, on_event=on_event):
+        logging.error(f"Failed to score accent for conversation {conversation_id}")
+        return False
+    return True
+
+def run_grammar_stage(conversation_id: str, socketio=None) -> bool:
+    notify_stage(socketio, conversation_id, "grammar")
+    on_event = (lambda payload: notify_sentence(socketio, conversation_id, payload)) if socketio else None
+    if not grammar_check_with_ai(conversation_id, publish=on_event):
+        logging.error(f"Failed to check grammar for conversation {conversation_id}")
+        return False
+    return True
+
+# (name, stage function, names of the stages it depends on); `jobs.JobScheduler`
+# gives every stage its own queue and workers and starts a stage as soon as its
+# dependencies are done, so after the split, TTS rendering, scoring and grammar
+# checking of a conversation run at the same time. `pipeline` runs them in order.
+PIPELINE_STAGES = [
+    ("split", run_split_stage, []),
+    ("tts", run_tts_stage, ["split"]),
+    ("score", run_score_stage, ["split"]),
+    ("grammar", run_grammar_stage, ["split"]),
+]
+
+def finalize_conversation(conversation_id: str, socketio=None) -> None:
+    """
+    Mark the conversation as finished, store a short summary and write the
+    complete index.json view.
+    """
+    logging.info(f"Pipeline completed for conversation {conversation_id}")
+
+    try:
+        store = ResultStore.for_conversation(conversation_id)
+        summary = " ".join(
+            s.get("sentence_text", "") for s in store.sentences()
+        )[:50] # Truncate to 50 characters
+        store.set_action("finished", summary=summary)
+        store.materialize()
+        if socketio:
+            notify_status(socketio, conversation_id, "finished")
+    except Exception as e:
+        logging.error(f"Error finalizing conversation {conversation_id}: {e}")
+
+def mark_failed(conversation_id: str, stage: str, socketio=None) -> None:
+    """
+    Record that `stage` failed so clients stop waiting on the conversation.
+    """
+    logging.error(f"Pipeline stage {stage} failed for conversation {conversation_id}")
+    try:
+        store = ResultStore.for_conversation(conversation_id)
+        store.set_action("error", failed_stage=stage)
+        store.materialize()
+    except Exception as e:
+        logging.error(f"Error marking conversation {conversation_id} as failed: {e}")
+    if socketio:
+        notify_status(socketio, conversation_id, "error", stage=stage)
+
 def pipeline(conversation_id: str, socketio=None):
     """
     Orchestrates the full processing pipeline for a conversation.
 
     Steps:
         1. Splits the conversation audio into sentences and generates sentence metadata.
-        2. Scores each sentence for accent accuracy using the configured TTS engine.
-        3. Performs AI-powered grammar analysis for each sentence.
-        4. Logs progress and errors at each stage.
+        2. Renders the native TTS reference of each sentence into the TTS cache.
+        3. Scores each sentence for accent accuracy using the configured TTS engine.
+        4. Performs AI-powered grammar analysis for each sentence.
+        5. Logs progress and errors at each stage.
+
+    Steps 2-4 only depend on step 1; the job scheduler runs them concurrently.
+
+    With EXECUTION_MODE=process the splitting and scoring stages run in the pre-warmed
+    worker processes of `worker_pool`; grammar checking is network bound and stays here.
+    The server does not call this directly: `jobs.JobScheduler` runs `PIPELINE_STAGES`
+    with a queue per stage so different conversations overlap.
 
     Args:
         conversation_id (str): Unique identifier for the conversation.
@@ -188,37 +412,11 @@ def pipeline(conversation_id: str, socketio=None):
     """
     
     logging.info(f"Starting pipeline for conversation {conversation_id}")
-    if socketio:
-        notify_status(socketio, conversation_id, "splitting")
-    if not split_conversation_to_sentences(conversation_id):
-        logging.error(f"Failed to process conversation {conversation_id}")
-        return
-    if socketio:
-        notify_status(socketio, conversation_id, "scoring")
-    logging.info(f"Scoring accent for conversation {conversation_id}")
-    if not score_accent(conversation_id):
-        logging.error(f"Failed to score accent for conversation {conversation_id}")
-        return
-    if socketio:
-        notify_status(socketio, conversation_id, "checking grammar")
-    if not grammar_check_with_ai(conversation_id):
-        logging.error(f"Failed to check grammar for conversation {conversation_id}")
-        return
-    logging.info(f"Pipeline completed for conversation {conversation_id}")
-
-    index_path = Path("data") / conversation_id / "index.json"
-    try:
-        with open(index_path, "r") as f:
-            index_data = json.load(f)
-        index_data["action"] = "finished"
-        index_data["summary"] = " ".join(
-            s.get("sentence_text", "") for s in index_data.get("sentences", [])
-        )[:50] # Truncate to 50 characters
-        util.save_info_to_file(str(index_path), index_data)
-        if socketio:
-            notify_status(socketio, conversation_id, "finished")
-    except Exception as e:
-        logging.error(f"Error finalizing index.json: {e}")
+    for name, stage, _ in PIPELINE_STAGES:
+        if not stage(conversation_id, socketio):
+            mark_failed(conversation_id, name, socketio)
+            return
+    finalize_conversation(conversation_id, socketio)
 
 if __name__ == "__main__":
     # Example usage
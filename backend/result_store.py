@@ -0,0 +1,271 @@
+"""
+Per-conversation result store.
+
+A conversation folder holds its results in two files instead of one big
+index.json that every stage re-reads and rewrites:
+
+• meta.json        ->  conversation metadata, action and stage status; small,
+                       rewritten atomically (temp file + os.replace)
+• sentences.jsonl  ->  append-only log of sentence records; the split stage
+                       writes one line per sentence and later stages append
+                       partial updates ({"id": 3, "word_scores": [...]}),
+                       which are merged in order when read
+
+A sentence update is therefore a single small append, and a status change
+never serializes the sentences. `view()` merges both into the original
+index.json shape for the frontend, and `materialize()` writes that view to
+index.json atomically (and compacts the log) when a conversation settles.
+Folders that only have a legacy index.json are migrated on first access.
+Every metadata write is mirrored into the data root's `catalog`.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+import catalog
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+DATA_ROOT = Path("data")
+META_FILE = "meta.json"
+SENTENCES_FILE = "sentences.jsonl"
+INDEX_FILE = "index.json"
+# action shown while a stage runs; "tts" is background work and has none
+STAGE_ACTIONS = {"split": "splitting", "score": "scoring", "grammar": "checking grammar"}
+
+_locks: dict[str, "_FolderLock"] = {}
+_locks_guard = threading.Lock()
+
+
+class _FolderLock:
+    """Re-entrant per-folder lock: a thread lock plus an flock held while depth > 0."""
+
+    def __init__(self):
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+
+def atomic_write_json(path: Path, data: Any, indent: int | None = 2) -> None:
+    """Write JSON to `path` so readers see either the old or the new file, never a torn one."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ResultStore:
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.meta_path = self.folder / META_FILE
+        self.sentences_path = self.folder / SENTENCES_FILE
+        self.index_path = self.folder / INDEX_FILE
+        with _locks_guard:
+            self._lock = _locks.setdefault(str(self.folder.resolve()), _FolderLock())
+
+    @classmethod
+    def for_conversation(cls, conversation_id: str, root: Path = DATA_ROOT) -> "ResultStore":
+        return cls(Path(root) / conversation_id)
+
+    # --- locking / migration ---
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Serialize writers across threads and (where supported) processes."""
+        lock = self._lock
+        with lock.rlock:
+            if lock.depth == 0 and fcntl is not None:
+                lock.file = open(self.folder / ".lock", "a")
+                fcntl.flock(lock.file, fcntl.LOCK_EX)
+            lock.depth += 1
+            try:
+                yield
+            finally:
+                lock.depth -= 1
+                if lock.depth == 0 and lock.file is not None:
+                    fcntl.flock(lock.file, fcntl.LOCK_UN)
+                    lock.file.close()
+                    lock.file = None
+
+    def _migrate(self) -> None:
+        """Split a legacy index.json into meta.json + sentences.jsonl."""
+        if self.meta_path.exists() or not self.index_path.exists():
+            return
+        with self._locked():
+            if self.meta_path.exists():
+                return
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index_data = json.load(f)
+            sentences = index_data.pop("sentences", [])
+            self._write_sentences(sentences)
+            atomic_write_json(self.meta_path, index_data)
+            logging.info(f"Migrated {self.index_path} to the result store")
+
+    def exists(self) -> bool:
+        return self.meta_path.exists() or self.index_path.exists()
+
+    # --- metadata ---
+
+    def create(self, meta: dict) -> dict:
+        """Start a new conversation with `meta` and no sentences."""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            atomic_write_json(self.meta_path, meta)
+            self._write_sentences([])
+            catalog.upsert(self.folder.parent, self.folder.name, meta)
+        return meta
+
+    def meta(self) -> dict:
+        self._migrate()
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def peek_meta(self) -> dict:
+        """
+        Metadata without migrating a legacy folder or taking its lock, for
+        readers that may not block on a writer (the catalog backfill).
+        """
+        if self.meta_path.exists():
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta.pop("sentences", None)
+        return meta
+
+    def update_meta(self, **fields: Any) -> dict:
+        """Merge `fields` into meta.json atomically and return the new metadata."""
+        self._migrate()
+        with self._locked():
+            meta = self.meta()
+            meta.update(fields)
+            atomic_write_json(self.meta_path, meta)
+            catalog.upsert(self.folder.parent, self.folder.name, meta)
+        return meta
+
+    def set_action(self, action: str, **fields: Any) -> dict:
+        return self.update_meta(action=action, **fields)
+
+    def stage_done(self, stage: str) -> bool:
+        return self.meta().get("stages", {}).get(stage) == "done"
+
+    def mark_stage(self, stage: str, status: str = "done") -> dict:
+        """
+        Record a stage's status ("running" or "done") under "stages". Until the
+        conversation settles, its action is derived from the running stages, so
+        concurrent stages show up together (e.g. "scoring + checking grammar")
+        instead of overwriting each other.
+        """
+        self._migrate()
+        with self._locked():
+            meta = self.meta()
+            stages = meta.setdefault("stages", {})
+            stages[stage] = status
+            running = catalog.ACTION_SEPARATOR.join(a for s, a in STAGE_ACTIONS.items() if stages.get(s) == "running")
+            if running and meta.get("action") not in ("finished", "error"):
+                meta["action"] = running
+            atomic_write_json(self.meta_path, meta)
+            catalog.upsert(self.folder.parent, self.folder.name, meta)
+        return meta
+
+    def start_stage(self, stage: str) -> dict:
+        """Mark `stage` as running unless it already finished; returns the metadata."""
+        if self.stage_done(stage):
+            return self.meta()
+        return self.mark_stage(stage, "running")
+
+    # --- sentences ---
+
+    def _write_sentences(self, sentences: list[dict]) -> None:
+        tmp = self.sentences_path.with_name(f".{SENTENCES_FILE}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for s in sentences:
+                f.write(json.dumps(s, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.sentences_path)
+
+    def set_sentences(self, sentences: list[dict]) -> None:
+        """Replace all sentence records (used by the split stage)."""
+        self._migrate()
+        with self._locked():
+            self._write_sentences(sentences)
+
+    def update_sentence(self, sentence_id: int, **fields: Any) -> None:
+        """Append a partial update for one sentence; nothing else is rewritten."""
+        self._migrate()
+        line = json.dumps({"id": sentence_id, **fields}, ensure_ascii=False) + "\n"
+        with self._locked():
+            with open(self.sentences_path, "a+b") as f:
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line  # don't glue onto a torn line
+                f.write(line.encode("utf-8"))
+                f.flush()
+
+    def sentences(self) -> list[dict]:
+        """Sentence records with all updates merged, in first-seen (timeline) order."""
+        self._migrate()
+        merged: dict[Any, dict] = {}
+        try:
+            with open(self.sentences_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn trailing line after a crash
+                    merged.setdefault(record.get("id"), {}).update(record)
+        except FileNotFoundError:
+            return []
+        return list(merged.values())
+
+    def clone_from(self, source: "ResultStore", **fields: Any) -> dict:
+        """
+        Copy the results of `source` into this (new) conversation: metadata with
+        `fields` applied, sentence records and the sentence audio (hard-linked when
+        possible). The conversation audio itself is not copied.
+        """
+        meta = {**source.meta(), **fields, "cloned_from": source.folder.name}
+        self.folder.mkdir(parents=True, exist_ok=True)
+        src_sentences = source.folder / "sentences"
+        if src_sentences.is_dir():
+            shutil.copytree(src_sentences, self.folder / "sentences", dirs_exist_ok=True,
+                            copy_function=_link_or_copy)
+        with self._locked():
+            self._write_sentences(source.sentences())
+            atomic_write_json(self.meta_path, meta)
+            catalog.upsert(self.folder.parent, self.folder.name, meta)
+        return meta
+
+    # --- views ---
+
+    def view(self) -> dict:
+        """The conversation in the original index.json shape."""
+        return {**self.meta(), "sentences": self.sentences()}
+
+    def materialize(self) -> dict:
+        """Write the index.json view atomically and compact the sentence log."""
+        self._migrate()
+        with self._locked():
+            view = self.view()
+            self._write_sentences(view["sentences"])
+            atomic_write_json(self.index_path, view)
+        return view
@@ -7,21 +7,48 @@ from pathlib import Path
 from datetime import datetime, timezone
 import time
 
-from process import pipeline
-from util import save_audio_to_wav
-import threading
+from process import (
+    PIPELINE_STAGES, finalize_conversation, interrupted_conversations, mark_failed, notify_status,
+)
+from util import stream_audio_to_wav, write_audio_segment
+from result_store import ResultStore
+import catalog
+import model_registry
+import tts_cache
+import grammar_cache
+import http_pool
+import jobs
+import worker_pool
 import shutil
 from flask_socketio import SocketIO, emit
 
 UPLOAD_ROOT = Path("data")
 ALLOWED_EXT = {".wav"}
-MAX_BYTES   = 25 * 1024 * 1024          # 25 MB per file
+MAX_BYTES   = int(float(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024)  # per file; uploads are streamed
+# re-uploads of an already processed recording (same sha256): "clone" its results into
+# the new id, "return" the existing conversation, or "off" to always run the pipeline
+UPLOAD_DEDUP = os.getenv("UPLOAD_DEDUP", "clone").lower()
 
 app = Flask(__name__)
 app.config["MAX_CONTENT_LENGTH"] = MAX_BYTES
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
+def report_queue_position(cid: str, position: int) -> None:
+    notify_status(socketio, cid, "queued", position=position)
+
+def make_stage(name, run, deps) -> jobs.Stage:
+    return jobs.Stage(name, lambda cid: run(cid, socketio), jobs.stage_workers(name), deps)
+
+# each pipeline stage gets its own queue and workers, so conversations overlap
+scheduler = jobs.JobScheduler(
+    [make_stage(name, run, deps) for name, run, deps in PIPELINE_STAGES],
+    max_queued=jobs.PIPELINE_QUEUE_SIZE,
+    on_position=report_queue_position,
+    on_complete=lambda cid: finalize_conversation(cid, socketio),
+    on_failed=lambda cid, stage: mark_failed(cid, stage, socketio),
+)
+
 @socketio.on('connect')
 def handle_connect():
     emit('status', {'message': 'Socket connection established'})
@@ -38,14 +65,41 @@ def new_conv_folder() -> Path:
     p.mkdir(parents=True, exist_ok=True)
     return cid, p
 
-def save_metadata(folder: Path, meta: dict) -> None:
-    (folder / "index.json").write_text(json.dumps(meta, indent=2))
+def reuse_results(cid: str, folder: Path, sha256: str, metadata: dict, audio_path: Path):
+    """
+    Serve an upload whose audio was already processed, per UPLOAD_DEDUP.
+    Returns the response, or None to process the upload normally.
+    """
+    # conversations from before uploads were hashed raw are indexed by their WAV's hash
+    wav_sha256 = None
+    if catalog.has_legacy_hashes(UPLOAD_ROOT):
+        with open(audio_path, "rb") as f:
+            wav_sha256 = hashlib.file_digest(f, "sha256").hexdigest()  # chunked, constant memory
+    duplicate = catalog.find_duplicate(UPLOAD_ROOT, sha256, exclude=cid, wav_sha256=wav_sha256)
+    if duplicate is None:
+        return None
+    source = ResultStore.for_conversation(duplicate["conversation_id"], UPLOAD_ROOT)
+    try:
+        if UPLOAD_DEDUP == "return":
+            existing = source.meta()
+            shutil.rmtree(folder, ignore_errors=True)
+            return {**existing, "duplicate_of": duplicate["conversation_id"]}, 200
+        store = ResultStore(folder)
+        metadata = store.clone_from(source, **dict(metadata, action="finished"))
+        store.materialize()
+    except (OSError, ValueError) as e:
+        app.logger.error(f"Could not reuse results of {duplicate['conversation_id']}: {e}")
+        return None
+    notify_status(socketio, cid, "finished")
+    return {**metadata, "queue_position": 0}, 201
 
 def map_state(action_id: str) -> tuple[int, int]:
     """
-    Maps the action ID to a human-readable state.
+    Maps the action ID to a human-readable state. Stages running at the same
+    time ("scoring + checking grammar") count as the earliest of them.
     """
     action_states = {
+        "queued": 1,
         "uploading": 1,
         "splitting": 2,
         "scoring": 3,
@@ -54,8 +108,8 @@ def map_state(action_id: str) -> tuple[int, int]:
         "error": 0
     }
     
-    current_action = action_states.get(action_id, 0)
-    total_actions = len(action_states) - 1
+    current_action = min(action_states.get(a, 0) for a in action_id.split(" + "))
+    total_actions = max(action_states.values())
     
     return current_action, total_actions
 
@@ -78,28 +132,39 @@ def upload_conversation():
         abort(400, "No selected file")
     if not allowed_file(file.filename):
         abort(400, "Only .wav files are accepted")
+    if scheduler.is_full():
+        abort(429, "Too many conversations are being processed, please retry later")
 
     cid, folder = new_conv_folder()
     original = secure_filename(file.filename)
     target   = folder / f"conversation_{cid}{Path(original).suffix.lower()}"
 
-    # stream to disk
-    save_audio_to_wav(file, str(target))
-
-    # robust: hash after save (streaming would be better for > MAX_BYTES)
-    h = hashlib.sha256(target.read_bytes()).hexdigest()
+    # stream into ffmpeg, hashing the raw upload in the same pass
+    try:
+        h = stream_audio_to_wav(file.stream, str(target))
+    except RuntimeError as e:
+        shutil.rmtree(folder, ignore_errors=True)
+        abort(400, f"Could not decode the uploaded audio: {e}")
 
-    # Save metadata in index.json inside the conversation_id folder
-    index_path = folder / "index.json"
+    # Save metadata in the result store inside the conversation_id folder
+    store = ResultStore(folder)
     metadata: dict[str, str] = {
         "conversation_id": cid,
         "filename": original,
         "sha256": h,
+        "sha256_of": "upload",   # raw upload bytes; older conversations hashed the converted WAV
         "uploaded_at": datetime.now(timezone.utc).isoformat(),
         "action": "uploading...",
     }
 
-    save_metadata(folder, metadata)
+    # same recording uploaded before: reuse its results unless reprocessing is forced
+    force = request.values.get("reprocess", "false").lower() == "true"
+    if UPLOAD_DEDUP != "off" and not force:
+        reused = reuse_results(cid, folder, h, metadata, target)
+        if reused is not None:
+            return reused
+
+    store.create(metadata)
 
     socketio.emit("status", {
         "conversation_id": cid,
@@ -107,26 +172,42 @@ def upload_conversation():
         "message": "File uploaded successfully, starting processing..."
     })
 
-    # Run pipeline in a background thread so it doesn't block the request
-    threading.Thread(target=pipeline, args=(cid,socketio), daemon=True).start()
+    # Queue the pipeline; a bounded pool of workers processes conversations
+    metadata = store.set_action("queued")
+    try:
+        position = scheduler.submit(cid)
+    except jobs.QueueFull:
+        shutil.rmtree(folder, ignore_errors=True)
+        catalog.remove(UPLOAD_ROOT, cid)
+        abort(429, "Too many conversations are being processed, please retry later")
 
-    return metadata, 201
+    return {**metadata, "queue_position": position}, 201
 
 
 @app.route("/list-audio", methods=["GET"])
 def list_audio():
+    """
+    List conversations from the catalog, newest upload first.
+
+    Query parameters (all optional):
+        limit, offset: page through the list; the total is in X-Total-Count
+        state: only conversations in these actions (comma separated, e.g. "finished,error")
+        order: "desc" (default) or "asc" by upload time
+    """
+    limit = request.args.get("limit", type=int)
+    offset = request.args.get("offset", default=0, type=int)
+    states = [s for s in request.args.get("state", "").split(",") if s]
+    newest_first = request.args.get("order", "desc").lower() != "asc"
+    rows, total = catalog.list_conversations(UPLOAD_ROOT, states, limit, offset, newest_first)
     out = []
-    for idx, child in enumerate(UPLOAD_ROOT.iterdir()):
-        meta_file = child / "index.json"
-        if meta_file.exists():
-            meta = json.loads(meta_file.read_text())
-            # summary = save_metadata_from_json(meta.get("sentence_text", ""))
-            summary = meta.get("summary", "")
-            action = meta.get("action", "error")
-            current_action, total_actions = map_state(action) 
-            out.append({"action": action, "total_actions": total_actions, "summary": summary,
-                        "actions_done": current_action, "id": meta["conversation_id"],})
-    return out
+    for meta in rows:
+        # summary = save_metadata_from_json(meta.get("sentence_text", ""))
+        summary = meta.get("summary") or ""
+        action = meta.get("action") or "error"
+        current_action, total_actions = map_state(action) 
+        out.append({"action": action, "total_actions": total_actions, "summary": summary,
+                    "actions_done": current_action, "id": meta["conversation_id"],})
+    return jsonify(out), 200, {"X-Total-Count": str(total)}
 
 @app.route("/delete-conversation/<conv_id>", methods=["DELETE"])
 def delete_conversation(conv_id: str):
@@ -136,6 +217,7 @@ def delete_conversation(conv_id: str):
     
     # Remove the entire conversation folder and its contents recursively
     shutil.rmtree(folder)
+    catalog.remove(UPLOAD_ROOT, conv_id)
 
     socketio.emit("status", {
         "conversation_id": conv_id,
@@ -151,7 +233,6 @@ def download_conversation(conv_id: str):
     if not folder.exists():
         abort(404, "Conversation ID not found")
 
-    meta = json.loads((folder / "index.json").read_text())
     stored_file = None
     # Try to find the actual stored file in the folder
     for f in folder.iterdir():
@@ -184,19 +265,89 @@ def get_native_reference(conv_id: str, sentence_id: int):
     
     return send_from_directory(folder, native_ref_file.name, as_attachment=True, mimetype="audio/wav")
 
+@app.route("/sentence-audio/<conv_id>/<int:sentence_id>", methods=["GET"])
+def get_sentence_audio(conv_id: str, sentence_id: int):
+    """
+    Serve the user's audio for one sentence (0-based, like /native-reference).
+    Sentence WAVs are not written during scoring; the first request cuts the
+    segment out of the conversation audio and later requests reuse the file.
+    """
+    folder = UPLOAD_ROOT / conv_id
+    if not folder.exists():
+        abort(404, "Conversation ID not found")
+
+    sentence_file = folder / "sentences" / f"sentence_{sentence_id}.wav"
+    if not sentence_file.exists():
+        sentence = next(
+            (s for s in ResultStore(folder).sentences() if s.get("id") == sentence_id + 1), None
+        )
+        if not sentence or "audio_timeline" not in sentence:
+            abort(404, "Sentence not found")
+        timeline = sentence["audio_timeline"]
+        write_audio_segment(
+            str(folder / f"conversation_{conv_id}.wav"), str(sentence_file),
+            timeline["start"], timeline["end"],
+        )
+
+    return send_from_directory(sentence_file.parent, sentence_file.name, mimetype="audio/wav")
+
 @app.route("/conv/<conv_id>", methods=["GET"])
 def get_conversation(conv_id: str):
     folder = UPLOAD_ROOT / conv_id
     if not folder.exists():
         abort(404, "Conversation ID not found")
 
-    meta = json.loads((folder / "index.json").read_text())
+    meta = ResultStore(folder).view()
 
     return jsonify(meta)
 
+@app.route("/conv/<conv_id>/partial", methods=["GET"])
+def get_conversation_partial(conv_id: str):
+    """
+    Results available so far, while the pipeline is still running: progress
+    counters plus only the sentences that already have scores or grammar.
+    Matches the payloads of the 'sentence' socket event.
+    """
+    folder = UPLOAD_ROOT / conv_id
+    if not folder.exists():
+        abort(404, "Conversation ID not found")
+
+    meta = ResultStore(folder).view()
+    sentences = meta.get("sentences", [])
+    ready = [
+        {k: v for k, v in s.items() if k != "words"}
+        for s in sentences if "word_scores" in s or "grammar_analysis" in s
+    ]
+    return jsonify({
+        "conversation_id": meta.get("conversation_id", conv_id),
+        "action": meta.get("action", "error"),
+        "queue_position": scheduler.position(conv_id),
+        "total_sentences": len(sentences),
+        "scored": sum("word_scores" in s for s in sentences),
+        "grammar_checked": sum("grammar_analysis" in s for s in sentences),
+        "sentences": ready,
+    })
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    return jsonify({
+        "models": model_registry.stats(),
+        "tts_cache": tts_cache.stats(),
+        "grammar_cache": grammar_cache.stats(),
+        "grammar_http": http_pool.stats(),
+        "jobs": scheduler.stats(),
+        "catalog": catalog.stats(),
+    })
+
 # ---------- main ------------------------------------------------------------
 
 if __name__ == "__main__":
     UPLOAD_ROOT.mkdir(exist_ok=True)
+    model_registry.start_idle_evictor()
+    worker_pool.start()
+    # resume conversations interrupted by a crash or deploy; finished stages are skipped
+    for cid in interrupted_conversations(UPLOAD_ROOT):
+        app.logger.info(f"Resuming conversation {cid}")
+        scheduler.submit(cid, force=True)
     # socketio.run(app, host="0.0.0.0", port=9000, debug=False)
     socketio.run(app, port=9000, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,188 @@
+"""
+Content-addressed cache for native TTS references.
+
+Entries are keyed on (engine, voice, text, sample rate). The rendered WAV and
+its WavLM embedding live on disk under TTS_CACHE_DIR and are evicted
+least-recently-used once the directory grows past TTS_CACHE_MAX_MB.
+Embeddings of recently used entries are also kept in memory, so a frequent
+phrase ("Thank you.", "I think so.") skips both the TTS call and the WavLM
+forward pass.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+import util
+
+ENABLED = os.getenv("TTS_CACHE", "True").lower() == "true"
+CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "cache/tts"))
+CACHE_MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", "512")) * 1024 * 1024)
+HOT_ENTRIES = int(os.getenv("TTS_CACHE_HOT_ENTRIES", "512"))
+
+# voice identity per engine, part of the key so a voice change never reuses audio
+VOICES = {
+    "coqui": util.COQUI_MODEL,
+    "gtts": "gtts:en:com",
+    "openai": "tts-1:alloy",
+}
+
+_lock = threading.Lock()
+_key_locks: dict[str, threading.Lock] = {}
+_hot: OrderedDict[str, Any] = OrderedDict()
+_disk_bytes: int | None = None
+_counters = {"wav_hits": 0, "wav_misses": 0, "emb_hot_hits": 0,
+             "emb_disk_hits": 0, "emb_misses": 0, "evictions": 0}
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(text: str, engine: str, sr: int = 16000) -> str:
+    voice = VOICES.get(engine, engine)
+    payload = json.dumps([engine, voice, normalize_text(text), sr], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _key_lock(key: str) -> threading.Lock:
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _path(key: str, suffix: str) -> Path:
+    return CACHE_DIR / key[:2] / f"{key}{suffix}"
+
+
+def _touch(path: Path) -> None:
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _counters[name] += 1
+
+
+def _account(nbytes: int) -> None:
+    """Track disk usage and evict least-recently-used entries above the cap."""
+    global _disk_bytes
+    with _lock:
+        if _disk_bytes is None:
+            _disk_bytes = sum(p.stat().st_size for p in CACHE_DIR.rglob("*") if p.is_file())
+        else:
+            _disk_bytes += nbytes
+        if _disk_bytes <= CACHE_MAX_BYTES:
+            return
+        files = sorted(
+            (p for p in CACHE_DIR.rglob("*") if p.is_file() and ".tmp" not in p.name),
+            key=lambda p: p.stat().st_mtime,
+        )
+        for p in files:
+            if _disk_bytes <= CACHE_MAX_BYTES * 0.9:
+                break
+            try:
+                size = p.stat().st_size
+                p.unlink()
+            except OSError:
+                continue
+            _disk_bytes -= size
+            _hot.pop(p.name.split(".")[0], None)
+            _counters["evictions"] += 1
+
+
+def native_wav(text: str, engine: str, sr: int = 16000) -> Path:
+    """
+    Path of the cached native rendering of `text`, synthesizing it on a miss.
+    Concurrent callers for the same key wait for a single rendering.
+    """
+    key = cache_key(text, engine, sr)
+    path = _path(key, ".wav")
+    with _key_lock(key):
+        if path.exists():
+            _count("wav_hits")
+            _touch(path)
+            return path
+        _count("wav_misses")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{key}.tmp-{os.getpid()}-{threading.get_ident()}.wav")
+        try:
+            util.synthesize_native(normalize_text(text), str(tmp), engine=engine)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+    _account(path.stat().st_size)
+    return path
+
+
+def copy_native_wav(text: str, engine: str, out_path: str, sr: int = 16000) -> str:
+    """Materialize the cached rendering at `out_path` (hard link when possible)."""
+    src = native_wav(text, engine, sr)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    try:
+        os.link(src, out_path)
+    except OSError:
+        shutil.copyfile(src, out_path)
+    return out_path
+
+
+def native_embedding(text: str, engine: str, embed_tag: str,
+                     compute: Callable[[Path], Any], sr: int = 16000) -> Any:
+    """
+    Cached embedding of the native rendering of `text`.
+
+    `embed_tag` identifies the embedding model/config so a model change never
+    reuses stale vectors; `compute(wav_path)` produces the embedding on a miss.
+    """
+    import torch
+    key = cache_key(text, engine, sr)
+    emb_key = hashlib.sha256(f"{key}:{embed_tag}".encode()).hexdigest()
+    with _lock:
+        if emb_key in _hot:
+            _hot.move_to_end(emb_key)
+            _counters["emb_hot_hits"] += 1
+            return _hot[emb_key]
+    path = _path(emb_key, ".pt")
+    with _key_lock(emb_key):
+        if path.exists():
+            _count("emb_disk_hits")
+            _touch(path)
+            emb = torch.load(path)
+        else:
+            _count("emb_misses")
+            emb = compute(native_wav(text, engine, sr)).detach().cpu()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{emb_key}.tmp-{os.getpid()}-{threading.get_ident()}.pt")
+            torch.save(emb, tmp)
+            os.replace(tmp, path)
+            _account(path.stat().st_size)
+    with _lock:
+        _hot[emb_key] = emb
+        _hot.move_to_end(emb_key)
+        while len(_hot) > HOT_ENTRIES:
+            _hot.popitem(last=False)
+    return emb
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_counters, hot_entries=len(_hot), disk_bytes=_disk_bytes or 0,
+                    max_bytes=CACHE_MAX_BYTES)
+
+
+def clear() -> None:
+    global _disk_bytes
+    with _lock:
+        _hot.clear()
+        _disk_bytes = 0
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+    logging.info(f"Cleared TTS cache {CACHE_DIR}")
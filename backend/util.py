@@ -1,18 +1,33 @@
 from werkzeug.datastructures.file_storage import FileStorage
+import hashlib
 import json
 import subprocess
 import os
+import threading
 import time
+from collections import deque
+from pathlib import Path
+import model_registry
+from result_store import atomic_write_json
+
+COQUI_MODEL = "tts_models/en/ljspeech/tacotron2-DDC_ph"
+
+def _load_coqui():
+    from TTS.api import TTS
+    # any English single‑speaker model works; this one sounds neutral/native
+    return TTS(COQUI_MODEL).to("cpu")
+
+model_registry.register(f"tts:{COQUI_MODEL}", _load_coqui, thread_safe=False)
 
 def save_info_to_file(file_path: str, data: dict) -> None:
     """
-    Save a dictionary to a JSON file.
+    Save a dictionary to a JSON file atomically (temp file + rename), so a
+    concurrent reader or a crash never leaves a half-written file.
     
     :param file_path: Path to the output JSON file
     :param data: Dictionary to save
     """
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    atomic_write_json(Path(file_path), data)
 
 def add_info_to_index(index_path: str, new_json: dict) -> dict:
     """
@@ -27,8 +42,7 @@ def add_info_to_index(index_path: str, new_json: dict) -> dict:
         index_data.update(new_json)
         
         # Write updated index back to file
-        with open(index_path, 'w', encoding='utf-8') as f:
-            json.dump(index_data, f, indent=2, ensure_ascii=False)
+        save_info_to_file(index_path, index_data)
         
         return index_data
     
@@ -67,6 +81,52 @@ def save_audio_to_wav(input_file, output_path: str) -> str:
         os.remove(temp_input_path)
         raise RuntimeError(f"Audio conversion failed: {e.stderr.decode('utf-8')}")
 
+def stream_audio_to_wav(stream, output_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Convert an uploaded audio stream to 16 kHz mono WAV by piping it into ffmpeg.
+
+    The stream is read chunk by chunk, hashed and written to ffmpeg's stdin in a
+    single pass, so memory stays constant and nothing is written but the output.
+
+    :param stream: Readable binary file object (e.g. FileStorage.stream)
+    :param output_path: Path of the WAV file to write
+    :param chunk_size: Bytes read per chunk
+    :return: SHA-256 hex digest of the raw uploaded bytes
+    """
+    h = hashlib.sha256()
+    proc = subprocess.Popen(
+        ['ffmpeg', '-y', '-i', 'pipe:0', '-ar', '16000', '-ac', '1', output_path],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    # drain stderr concurrently, otherwise a chatty ffmpeg blocks on a full pipe
+    stderr_tail: deque[bytes] = deque(maxlen=64)
+    drain = threading.Thread(target=lambda: stderr_tail.extend(proc.stderr), daemon=True)
+    drain.start()
+    try:
+        while chunk := stream.read(chunk_size):
+            h.update(chunk)
+            proc.stdin.write(chunk)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its exit code and stderr explain why
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = proc.wait()
+        drain.join()
+    if returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise RuntimeError(f"Audio conversion failed: {b''.join(stderr_tail).decode('utf-8', 'replace')}")
+    print(f"Audio converted and saved to {output_path}")
+    return h.hexdigest()
+
 
 def play_audio_segment(audio_path: str, start_time: float, end_time: float) -> None:
     """
@@ -102,10 +162,8 @@ def synthesize_native(text: str, out_wav: str, engine: str = "coqui"):
     • engine="openai" ->  OpenAI TTS (needs API key, pip install openai)
     """
     if engine == "coqui":
-        from TTS.api import TTS
-        # any English single‑speaker model works; this one sounds neutral/native
-        tts = TTS("tts_models/en/ljspeech/tacotron2-DDC_ph").to("cpu")
-        tts.tts_to_file(text=text, file_path=out_wav, speaker_wav=None)
+        with model_registry.use(f"tts:{COQUI_MODEL}") as tts:
+            tts.tts_to_file(text=text, file_path=out_wav, speaker_wav=None)
     elif engine == "gtts":
         from gtts import gTTS
         tmp_mp3 = out_wav + ".mp3"
@@ -140,6 +198,29 @@ def cut_audio(input_path: str, output_path: str, start: float, end: float):
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"Audio cutting failed: {e.stderr.decode('utf-8')}")
 
+def write_audio_segment(input_path: str, output_path: str, start: float, end: float):
+    """
+    Write the [start, end] seconds of a WAV file to output_path.
+    Only the requested frames are read (no ffmpeg process, no full decode).
+    The segment is written to a temp file and renamed into place, so a
+    concurrent writer or reader never sees a partial file.
+    """
+    import soundfile as sf
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    with sf.SoundFile(input_path) as f:
+        sr = f.samplerate
+        f.seek(min(int(start * sr), f.frames))
+        data = f.read(max(0, int(end * sr) - int(start * sr)), dtype="float32")
+    tmp = f"{output_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        sf.write(tmp, data, sr, format="WAV")
+        os.replace(tmp, output_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
 if __name__ == "__main__":
     synthesize_native(
         "This is a test sentence for the native speaker audio generation.",
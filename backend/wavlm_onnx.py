@@ -0,0 +1,117 @@
+"""
+WavLM through ONNX Runtime.
+
+`OnnxWavLM` wraps an exported WavLM graph behind the same
+`extract_features(waveforms, lengths)` call as the torchaudio model, so
+`accent_check` can use either one. The graph is exported from the torchaudio
+model the first time it is needed and kept under WAVLM_ONNX_DIR; an int8
+variant is derived from it with ONNX Runtime's dynamic quantization.
+
+Export uses the TorchScript exporter (newer torch releases default to the
+dynamo one, which needs onnxscript). Quantization needs the `onnx` package,
+which onnxruntime does not pull in: pip install onnx==1.18.0.
+"""
+import inspect
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+
+ONNX_DIR = Path(os.getenv("WAVLM_ONNX_DIR", "cache/onnx"))
+OPSET = 17
+
+
+class _ExportWrapper(torch.nn.Module):
+    """Flattens extract_features' list of layers into one (L, B, frames, D) output."""
+
+    def __init__(self, model, num_layers: int | None = None):
+        super().__init__()
+        self.model = model
+        self.num_layers = num_layers
+
+    def forward(self, waveforms, lengths):
+        feats, frame_lengths = self.model.extract_features(waveforms, lengths, num_layers=self.num_layers)
+        return torch.stack(feats), frame_lengths
+
+
+def export(model, path: Path, num_layers: int | None = None) -> Path:
+    """
+    Export a torchaudio WavLM model to `path` with dynamic batch and length axes.
+    With `num_layers` the graph stops after that many transformer layers.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.stem}.tmp-{os.getpid()}.onnx")
+    dummy = torch.zeros(1, 16000)
+    # the TorchScript exporter needs no extra packages; torch >= 2.5 defaults to dynamo
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            _ExportWrapper(model.eval(), num_layers), (dummy, torch.tensor([16000])), str(tmp),
+            input_names=["waveforms", "lengths"],
+            output_names=["layers", "frame_lengths"],
+            dynamic_axes={
+                "waveforms": {0: "batch", 1: "samples"},
+                "lengths": {0: "batch"},
+                "layers": {1: "batch", 2: "frames"},
+                "frame_lengths": {0: "batch"},
+            },
+            opset_version=OPSET,
+            **legacy,
+        )
+    os.replace(tmp, path)
+    logging.info(f"Exported WavLM to {path}")
+    return path
+
+
+def quantize(src: Path, path: Path) -> Path:
+    """Dynamic int8 quantization of an exported graph's weights."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # optional: pip install onnx==1.18.0
+    tmp = path.with_name(f"{path.stem}.tmp-{os.getpid()}.onnx")
+    quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QInt8)
+    os.replace(tmp, path)
+    logging.info(f"Quantized {src} to {path}")
+    return path
+
+
+class OnnxWavLM:
+    def __init__(self, path: Path, group_norm: bool = False):
+        import onnxruntime as ort
+        self.path = path
+        self.group_norm = group_norm  # feature extractor normalizes over the padded time axis
+        self.session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+
+    @classmethod
+    def from_model(cls, load_model, name: str, int8: bool = False,
+                   num_layers: int | None = None, group_norm: bool = False) -> "OnnxWavLM":
+        """
+        Session for `name` (e.g. "large"), exporting `load_model()` on first use.
+        A graph truncated to `num_layers` is exported (and cached) separately.
+        `group_norm` records the model's feature extractor mode for batching.
+        """
+        stem = f"wavlm_{name}" + (f"_L{num_layers}" if num_layers else "")
+        fp32 = ONNX_DIR / f"{stem}.onnx"
+        if not fp32.exists():
+            export(load_model(), fp32, num_layers)
+        if not int8:
+            return cls(fp32, group_norm)
+        quantized = ONNX_DIR / f"{stem}_int8.onnx"
+        if not quantized.exists():
+            quantize(fp32, quantized)
+        return cls(quantized, group_norm)
+
+    def extract_features(self, waveforms: torch.Tensor, lengths: torch.Tensor | None = None,
+                         num_layers: int | None = None):
+        """
+        Same contract as torchaudio's WavLM: (list of (B, frames, D) layers, frame
+        lengths). The layers are those the graph was exported with; `num_layers`
+        keeps the first ones.
+        """
+        waveforms = waveforms.detach().cpu().float()
+        if lengths is None:
+            lengths = torch.full((waveforms.shape[0],), waveforms.shape[1])
+        layers, frame_lengths = self.session.run(
+            None, {"waveforms": waveforms.numpy(), "lengths": lengths.cpu().numpy().astype(np.int64)},
+        )
+        return list(torch.from_numpy(layers))[:num_layers], torch.from_numpy(frame_lengths)
@@ -0,0 +1,147 @@
+"""
+Optional process-pool execution of the CPU-heavy pipeline stages.
+
+With EXECUTION_MODE=process, `run_stage` runs ASR (`make_timeline`) and
+scoring in a pool of STAGE_PROCESSES pre-warmed worker processes. Each
+worker loads Whisper and WavLM once at start-up and keeps them, so those
+stages no longer hold the GIL of the Flask/SocketIO process.
+
+Only the conversation id crosses the process boundary: workers read the
+audio and write results to the conversation folder themselves, and the
+parent reads them back from disk. Nothing waveform-sized is pickled. Status
+events are still emitted by the parent around each stage; small per-sentence
+events published by a stage travel back over a manager queue and are handed
+to the caller's `on_event` callback in the parent.
+
+With EXECUTION_MODE=thread (the default) stages simply run in the caller.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "thread").lower()  # "thread" or "process"
+STAGE_PROCESSES = int(os.getenv("STAGE_PROCESSES", "1"))
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))  # per worker, 0 keeps torch's default
+
+_pool: ProcessPoolExecutor | None = None
+_lock = threading.Lock()
+_events = None                                   # manager queue: workers -> parent
+_handlers: dict[str, Callable[[Any], None]] = {}
+_END = "__end__"
+
+
+class _EventSink:
+    """Picklable `publish` callable handed to stages running in a worker."""
+
+    def __init__(self, queue, token: str):
+        self.queue = queue
+        self.token = token
+
+    def __call__(self, payload: Any) -> None:
+        self.queue.put((self.token, payload))
+
+
+def _relay() -> None:
+    """Deliver events from worker processes to the handlers registered in run_stage."""
+    while True:
+        token, payload = _events.get()
+        handler = _handlers.get(token)
+        if handler is None:
+            continue
+        try:
+            handler(payload)
+        except Exception as e:
+            logging.error(f"Stage event handler failed: {e}")
+
+
+def _warm_worker() -> None:
+    """Process initializer: load the stage models once per worker."""
+    import torch
+    import model_registry, align_text, accent_check
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
+    for name in (align_text.timeline_model(), accent_check.WAVLM_MODEL):
+        model_registry.get(name)
+    logging.info(f"Stage worker {os.getpid()} ready")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool, _events
+    with _lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context("spawn")
+            if _events is None:
+                _events = ctx.Manager().Queue()
+                threading.Thread(target=_relay, name="stage-events", daemon=True).start()
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, STAGE_PROCESSES),
+                mp_context=ctx,
+                initializer=_warm_worker,
+            )
+        return _pool
+
+
+def start() -> None:
+    """Spawn and pre-warm the workers now rather than on the first upload."""
+    if EXECUTION_MODE != "process":
+        return
+    pool = get_pool()
+    pids = {f.result() for f in [pool.submit(_ping) for _ in range(max(1, STAGE_PROCESSES))]}
+    logging.info(f"Stage worker pool started: {sorted(pids)}")
+
+
+def run_stage(fn: Callable[..., Any], *args: Any,
+              on_event: Callable[[Any], None] | None = None) -> Any:
+    """
+    Run a pipeline stage. `fn` must be a module-level function taking and
+    returning small picklable values (e.g. conversation id -> bool).
+    If `on_event` is given, `fn` is called with a `publish` keyword argument;
+    every payload it publishes reaches `on_event` in this process, in order,
+    before run_stage returns.
+    """
+    if EXECUTION_MODE != "process":
+        return fn(*args, **({"publish": on_event} if on_event else {}))
+    global _pool
+    pool = get_pool()
+    kwargs, token, drained = {}, None, threading.Event()
+    if on_event is not None:
+        token = uuid.uuid4().hex
+
+        def handler(payload):
+            if payload == _END:
+                drained.set()
+            else:
+                on_event(payload)
+
+        _handlers[token] = handler
+        kwargs["publish"] = _EventSink(_events, token)
+    try:
+        return pool.submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        logging.error(f"Stage worker died running {fn.__name__}: {e}")
+        with _lock:
+            _pool = None  # respawn on next use
+        return False
+    finally:
+        if token is not None:
+            # the worker's events were queued before its result; wait for them
+            _events.put((token, _END))
+            drained.wait(timeout=10)
+            _handlers.pop(token, None)
+
+
+def shutdown() -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None